@@ -0,0 +1,271 @@
+#! encoding=utf-8
+"""
+    传输后端对比：同一个模拟 run 目录，分别用 ossutil、oss2.resumable_upload、push_by_piece、sendfile、
+    单流 GET 和分段并发下载对本地替身服务（standin.py）做上传 / 下载，
+    按并发数和文件大小组合输出吞吐、单文件延迟 p50/p99、CPU 时间和峰值内存
+
+    每个组合在单独的子进程里运行，CPU 和峰值内存只统计客户端（含 ossutil 子进程），不含替身服务
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import oss2
+
+import standin
+from fetch import RangedDownloader
+from nextseq import Sequence
+from zerocopy import SendfileUploader
+
+logger = logging.getLogger(__name__)
+
+script_dir = Path(__file__).resolve().parent
+
+BUCKET = 'bench'
+CHIP = '200101_NB500000_0001_AHBENCHXXX'
+MIXES = ('bcl', 'small', 'mixed')
+UPLOAD_BACKENDS = ('ossutil', 'oss2-resumable', 'push_by_piece', 'sendfile')
+DOWNLOAD_BACKENDS = ('ossutil', 'oss2-get', 'ranged')
+
+
+def ossutil_path():
+    names = {'win32': 'ossutil64.exe', 'linux': 'ossutil64', 'darwin': 'ossutilmac64'}
+    path = script_dir / names.get(sys.platform, 'ossutil64')
+    return path if path.exists() else None
+
+
+def make_run(root, mix, cycles, bcl_size, small_files, small_size):
+    """按 NextSeq 目录结构生成模拟 run，返回 [(文件, 相对 run 根目录的 key)]"""
+    seq = Sequence(Path(root) / mix / CHIP)
+    seq.seq_dir.mkdir(parents=True, exist_ok=True)
+    seq.run_info_xml.write_text(f'<RunInfo><Run><Reads><Read Number="1" NumCycles="{cycles}"/></Reads></Run></RunInfo>')
+    block = os.urandom(1024 * 1024)
+    files = [seq.run_info_xml]
+
+    def write(path, size):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            while size > 0:
+                f.write(block[:min(size, len(block))])
+                size -= len(block)
+        files.append(path)
+
+    if mix in ('bcl', 'mixed'):
+        for lane in range(1, seq.lane_count + 1):
+            for cycle in range(1, cycles + 1):
+                write(seq.cycle_bcl_files(cycle, lane), bcl_size)
+                write(seq.cycle_bcl_index_files(cycle, lane), 4096)
+    if mix in ('small', 'mixed'):
+        for n in range(small_files):
+            lane = n % seq.lane_count + 1
+            write(seq.thumbnail_images_dir / f'L00{lane}' / f'C{n // 100 + 1}.1' / f's_{lane}_{n:05d}.jpg', small_size)
+    return [(x, x.relative_to(seq.seq_dir.parent).as_posix()) for x in files]
+
+
+def make_bucket(endpoint, concurrency):
+    oss2.defaults.connection_pool_size = max(10, concurrency * 8)
+    return oss2.Bucket(oss2.Auth('bench', 'bench'), endpoint, BUCKET)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def transfer_func(case, bucket, work_dir):
+    """返回处理单个 (文件, key) 的函数"""
+    backend = case['backend']
+    prefix = case['prefix']
+    if case['direction'] == 'up':
+        if backend == 'oss2-resumable':
+            store = oss2.ResumableStore(root=str(work_dir))
+            return lambda x: oss2.resumable_upload(bucket, f'{prefix}/{x[1]}', filename=str(x[0]), num_threads=3, store=store)
+        if backend == 'push_by_piece':
+            from push import PushTask
+            task = PushTask(case['run_dir'], BUCKET)
+            task.bucket = bucket
+            return lambda x: task.push_by_piece(x[0], f'{prefix}/{x[1]}')
+        if backend == 'sendfile':
+            uploader = SendfileUploader(bucket)
+            return lambda x: uploader.upload(x[0], f'{prefix}/{x[1]}')
+    else:
+        dest = Path(work_dir)
+        if backend == 'oss2-get':
+            def get(x):
+                path = dest / x[1]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                bucket.get_object_to_file(f'{case["source"]}/{x[1]}', str(path))
+            return get
+        if backend == 'ranged':
+            downloader = RangedDownloader(bucket)
+            return lambda x: downloader.download(f'{case["source"]}/{x[1]}', dest / x[1])
+    raise ValueError(f'unknown backend {backend}')
+
+
+def ossutil_cmd(case, work_dir):
+    config = Path(work_dir) / 'ossutil.ini'
+    config.write_text(f'[Credentials]\nlanguage=EN\nendpoint={case["endpoint"]}\n'
+                      f'accessKeyID=bench\naccessKeySecret=bench\n')
+    jobs = case['concurrency']
+    if case['direction'] == 'up':
+        src, dest = case['run_dir'], f'oss://{BUCKET}/{case["prefix"]}/{CHIP}/'
+    else:
+        src, dest = f'oss://{BUCKET}/{case["source"]}/', str(work_dir)
+    return [str(ossutil_path()), '--config-file', str(config), 'cp', '-r', '-f',
+            '--jobs', str(jobs), '--parallel', str(jobs), src, dest]
+
+
+def run_case(case, queue):
+    """在子进程里执行一个组合，结果放入 queue"""
+    work_dir = Path(tempfile.mkdtemp(dir=case['work_dir']))
+    files = [(Path(x), key) for x, key in case['files']]
+    latencies = []
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    try:
+        if case['backend'] == 'ossutil':
+            subprocess.run(ossutil_cmd(case, work_dir), check=True, stdout=subprocess.DEVNULL)
+        else:
+            func = transfer_func(case, make_bucket(case['endpoint'], case['concurrency']), work_dir)
+
+            def one(x):
+                t = time.time()
+                func(x)
+                latencies.append(time.time() - t)
+            with ThreadPoolExecutor(max_workers=case['concurrency']) as pool:
+                for _ in pool.map(one, files):
+                    pass
+        error = None
+    except Exception as e:
+        error = str(e)
+    wall = time.time() - start
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (self_after.ru_utime - self_before.ru_utime + self_after.ru_stime - self_before.ru_stime
+           + children_after.ru_utime - children_before.ru_utime + children_after.ru_stime - children_before.ru_stime)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    queue.put({
+        'wall': wall,
+        'cpu': cpu,
+        'rss': max(self_after.ru_maxrss, children_after.ru_maxrss) / 1024,  # Linux 下单位为 KB
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'error': error,
+    })
+
+
+def run_isolated(case):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    p = ctx.Process(target=run_case, args=(case, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+def seed(endpoint, prefix, files):
+    """下载测试用的源对象，不计时"""
+    bucket = make_bucket(endpoint, 8)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in pool.map(lambda x: bucket.put_object_from_file(f'{prefix}/{x[1]}', str(x[0])), files):
+            pass
+
+
+def print_table(rows):
+    header = ('backend', 'dir', 'mix', 'conc', 'files', 'MB', 'MB/s', 'p50 ms', 'p99 ms', 'CPU s', 'CPU s/GB', 'RSS MB')
+    print(('{:<16}{:<5}{:<7}{:>5}{:>7}{:>9}{:>8}{:>9}{:>9}{:>8}{:>10}{:>8}').format(*header))
+
+    def ms(x):
+        return '-' if x is None else f'{x * 1000:.0f}'
+    for r in rows:
+        if r['error']:
+            print(f'{r["backend"]:<16}{r["direction"]:<5}{r["mix"]:<7}{r["concurrency"]:>5}  error: {r["error"]}')
+            continue
+        mb = r['bytes'] / 1024 / 1024
+        print(('{:<16}{:<5}{:<7}{:>5}{:>7}{:>9.1f}{:>8.1f}{:>9}{:>9}{:>8.2f}{:>10.2f}{:>8.0f}').format(
+            r['backend'], r['direction'], r['mix'], r['concurrency'], r['files'], mb, mb / r['wall'],
+            ms(r['p50']), ms(r['p99']), r['cpu'], r['cpu'] / (mb / 1024) if mb else 0, r['rss']))
+
+
+def main():
+    args = arg_handle()
+    logging.basicConfig(level='DEBUG' if args.verbose else 'INFO', format='%(levelname)s %(message)s')
+    work_dir = Path(args.workdir or tempfile.mkdtemp(prefix='mdx-bench-')).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    backends = args.backends.split(',')
+    if 'ossutil' in backends and ossutil_path() is None:
+        logger.warning(f'ossutil not found in {script_dir}, skip it')
+        backends.remove('ossutil')
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=standin.serve, args=(work_dir / 'server',), kwargs={'ready': ready}, daemon=True)
+    server.start()
+    endpoint = f'http://127.0.0.1:{ready.get(timeout=30)}'
+
+    rows = []
+    try:
+        for mix in args.mix.split(','):
+            logger.info(f'generating {mix} run...')
+            files = make_run(work_dir / 'runs', mix, args.cycles, int(args.bcl_size * 1024 * 1024),
+                             args.small_files, args.small_size * 1024)
+            size = sum(x.stat().st_size for x, _ in files)
+            source = f'seed/{mix}'
+            if 'down' in args.directions:
+                seed(endpoint, source, files)
+            for direction in args.directions.split(','):
+                names = UPLOAD_BACKENDS if direction == 'up' else DOWNLOAD_BACKENDS
+                for backend in [x for x in backends if x in names]:
+                    for concurrency in [int(x) for x in args.concurrency.split(',')]:
+                        case = {
+                            'backend': backend, 'direction': direction, 'mix': mix, 'concurrency': concurrency,
+                            'endpoint': endpoint, 'work_dir': str(work_dir), 'run_dir': str(files[0][0].parent),
+                            'prefix': f'{backend}/{mix}/{concurrency}', 'source': source,
+                            'files': [(str(x), key) for x, key in files],
+                        }
+                        logger.info(f'{direction} {mix} with {backend}, concurrency {concurrency}...')
+                        result = run_isolated(case)
+                        result.update(backend=backend, direction=direction, mix=mix, concurrency=concurrency,
+                                      files=len(files), bytes=size)
+                        rows.append(result)
+    finally:
+        server.terminate()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print_table(rows)
+
+
+def arg_handle():
+    parser = argparse.ArgumentParser(description='compare transfer backends against a local stand-in server')
+    parser.add_argument('--backends', default=','.join(sorted(set(UPLOAD_BACKENDS + DOWNLOAD_BACKENDS))),
+                        help='comma separated, upload: %s; download: %s' % (
+                            ', '.join(UPLOAD_BACKENDS), ', '.join(DOWNLOAD_BACKENDS)))
+    parser.add_argument('--directions', default='up,down', help='up, down or both')
+    parser.add_argument('--concurrency', default='1,4,16', help='files in flight, comma separated')
+    parser.add_argument('--mix', default=','.join(MIXES), help='file size mix: %s' % ', '.join(MIXES))
+    parser.add_argument('--cycles', type=int, default=4, help='cycles of the synthetic run')
+    parser.add_argument('--bcl-size', dest='bcl_size', type=float, default=16, help='MB per bcl file')
+    parser.add_argument('--small-files', dest='small_files', type=int, default=400, help='number of small files')
+    parser.add_argument('--small-size', dest='small_size', type=int, default=16, help='KB per small file')
+    parser.add_argument('--workdir', metavar='dir', help='dir for synthetic runs and server data, default a temp dir')
+    parser.add_argument('--keep', action='store_true', default=False, help='keep workdir after bench')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='output all log info')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+    pull 端本地 run 缓存：按空间预算管理已下载的 run，分析完成的和最久未用的优先淘汰，磁盘将满时暂停下载
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+
+from checkpoint import dump_json
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+
+def du(path):
+    total = 0
+    for root, dirs, names in os.walk(path):
+        for x in names:
+            try:
+                total += os.lstat(os.path.join(root, x)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class RunCache(object):
+    """
+    root 下每个 run 一个目录，台账保存在 root/.mdx.cache.json：
+        chip -> {'state': pulling / ready / evicted, 'size': 字节数, 'reserved': 预留字节数, 'last_access': 时间戳}
+
+    budget 为 None 时不主动淘汰，只在磁盘剩余空间低于 min_free 时暂停下载（反压）。
+    分析流程在 run 目录下创建 .analysis_done 后，该 run 最先被淘汰；被淘汰的 run 可以用 pull.py --fetch 重新拉取。
+    其余 run 按最近访问时间淘汰：取最后一次拉取完成的时间和 .analysis_access 的 mtime 中较晚的一个，
+    分析流程读取 run 时 touch 这个文件，正在分析的 run 就不会先被淘汰。
+
+    常驻的 pull 进程和 --fetch 进程共用台账，每次修改都在 root/.mdx.cache.lock 的文件锁内重新读取、修改、保存。
+    """
+
+    ledger_name = '.mdx.cache.json'
+    lock_name = '.mdx.cache.lock'
+    done_flag = '.analysis_done'
+    access_flag = '.analysis_access'
+
+    def __init__(self, root, budget=None, min_free=10 * GB, cycle_size=250 * 1024 * 1024, wait_interval=60):
+        self.root = Path(root)
+        self.budget = budget
+        self.min_free = min_free
+        self.cycle_size = cycle_size
+        self.wait_interval = wait_interval
+        self.ledger = self.root / self.ledger_name
+        self.runs = {}
+        self.lock = Lock()
+
+    @contextmanager
+    def locked(self):
+        """线程锁 + 文件锁，进入时从台账重新读取，退出时保存"""
+        with self.lock, open(self.root / self.lock_name, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.read()
+                yield
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        if self.ledger.exists():
+            with open(self.ledger) as f:
+                self.runs = json.load(f)
+
+    def load(self, finished=None):
+        """
+        启动前已经存在、台账里没有的 run 也纳入管理，大小等到需要时再统计。
+        finished(chip) 判断这个 run 是否已经下载完成，完成的才可以淘汰，没完成的按 pulling 处理，等 finish 后再变成 ready。
+        """
+        with self.locked():
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name not in self.runs and len(entry.name.split('_')) == 4:
+                        state = 'ready' if finished is not None and finished(entry.name) else 'pulling'
+                        self.runs[entry.name] = {'state': state, 'size': None, 'reserved': 0,
+                                                 'last_access': entry.stat().st_mtime}
+
+    def save(self):
+        dump_json(self.runs, self.ledger, indent=2)
+
+    def size(self, chip):
+        run = self.runs[chip]
+        if run['size'] is None:
+            run['size'] = du(self.root / chip)
+        return run['size']
+
+    def used(self):
+        return sum(self.size(x) + self.runs[x]['reserved'] for x in self.runs if self.runs[x]['state'] != 'evicted')
+
+    def last_access(self, chip):
+        try:
+            touched = (self.root / chip / self.access_flag).stat().st_mtime
+        except FileNotFoundError:
+            touched = 0
+        return max(self.runs[chip]['last_access'], touched)
+
+    def candidates(self):
+        """可淘汰的 run：分析完成的在前，其余按最近访问时间从旧到新（目录 atime 会被统计大小时的遍历刷新，不可靠）"""
+        ready = [x for x in self.runs if self.runs[x]['state'] == 'ready']
+        return sorted(ready, key=lambda x: (not (self.root / x / self.done_flag).exists(), self.last_access(x)))
+
+    def evict(self, chip):
+        logger.warning(f'evict {chip} from local cache, {self.size(chip) / GB:.1f} GB')
+        shutil.rmtree(self.root / chip, ignore_errors=True)
+        self.runs[chip].update(state='evicted', size=0, reserved=0)
+
+    def over_limit(self, need):
+        if self.budget is not None and self.used() + need > self.budget:
+            return True
+        return shutil.disk_usage(self.root).free < need + self.min_free
+
+    def make_room(self, need):
+        """需要时按顺序淘汰，直到满足预算和剩余空间；没有可淘汰的 run 时等待"""
+        warned = False
+        while True:
+            with self.locked():
+                if not self.over_limit(need):
+                    return
+                candidates = self.candidates() if self.budget is not None else []
+                if candidates:
+                    self.evict(candidates[0])
+                    continue
+            if not warned:
+                logger.warning(f'no space for {need / GB:.1f} GB in {self.root}, wait for space...')
+                warned = True
+            time.sleep(self.wait_interval)
+
+    def reserve(self, chip, cycles):
+        """run 开始下载前按 cycle 数预留空间"""
+        estimate = cycles * self.cycle_size
+        with self.locked():
+            run = self.runs.setdefault(chip, {'state': 'pulling', 'size': 0, 'reserved': 0, 'last_access': time.time()})
+            run.update(state='pulling', reserved=0, size=None, last_access=time.time())
+            need = max(0, estimate - self.size(chip))
+        self.make_room(need)
+        with self.locked():
+            self.runs[chip]['reserved'] = need
+        logger.info(f'reserved {need / GB:.1f} GB for {chip}')
+
+    def wait_for_space(self):
+        """每个文件下载前调用，只检查磁盘剩余空间，预留已经在 reserve 时算过"""
+        if shutil.disk_usage(self.root).free < self.min_free:
+            self.make_room(0)
+
+    def finish(self, chip):
+        size = du(self.root / chip)
+        with self.locked():
+            self.runs[chip].update(state='ready', reserved=0, size=size, last_access=time.time())
@@ -0,0 +1,101 @@
+"""
+    push 断点记录：记录每个 chip 已完成的文件，先写临时文件再改名，重启后从断点继续
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def dump_json(obj, path, indent=None):
+    """先写同目录临时文件再 rename，进程中途被杀也不会留下半个 json"""
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Checkpoint(object):
+    """
+    chip -> {文件名: [size, mtime_ns]}，目录记为 ['dir', 推送方式]，推送方式为 files（逐个文件）或 pack（打包），
+    目录只在其下文件全部完成后记录，换了推送方式（如开启 --pack）的目录会重新推送。
+
+    文件的 size 和 mtime 都没变才算已完成，重启后这些文件不再查询远端；
+    保存最多每 interval 秒一次，中途被杀最多丢失几秒的进度，丢失的部分会按原逻辑重新比对远端。
+    """
+
+    def __init__(self, path, interval=5):
+        self.path = Path(path)
+        self.interval = interval
+        self.chips = {}
+        self.last_save = 0
+        self.dirty = False
+        self.lock = Lock()
+
+    def load(self):
+        if self.path.exists():
+            with open(self.path) as f:
+                self.chips = json.load(f)
+        if self.chips:
+            logger.info(f'checkpoint loaded, {len(self.chips)} chips in progress')
+
+    def in_progress(self):
+        return list(self.chips)
+
+    @staticmethod
+    def stat(path, mode='files'):
+        path = Path(path)
+        if path.is_dir():
+            return ['dir', mode]
+        st = path.stat()
+        return [st.st_size, st.st_mtime_ns]
+
+    def start(self, chip):
+        with self.lock:
+            if chip in self.chips:
+                return
+            self.chips[chip] = {}
+        self.save(force=True)
+
+    def mark(self, chip, name, path, mode='files'):
+        state = self.stat(path, mode)
+        with self.lock:
+            self.chips.setdefault(chip, {})[name] = state
+            self.dirty = True
+        self.save()
+
+    def is_done(self, chip, name, path, mode='files'):
+        files = self.chips.get(chip)
+        if not files or name not in files:
+            return False
+        try:
+            return files[name] == self.stat(path, mode)
+        except FileNotFoundError:
+            return False
+
+    def done_paths(self, chip, root):
+        return {Path(root) / name for name in self.chips.get(chip, {})}
+
+    def finish(self, chip):
+        with self.lock:
+            self.chips.pop(chip, None)
+            self.dirty = True
+        self.save(force=True)
+
+    def save(self, force=False):
+        with self.lock:
+            if not self.dirty and not force:
+                return
+            if not force and time.time() - self.last_save < self.interval:
+                return
+            dump_json(self.chips, self.path)
+            self.last_save = time.time()
+            self.dirty = False
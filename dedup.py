@@ -0,0 +1,116 @@
+"""
+    内容指纹缓存：记录本地文件的内容哈希（按 size + mtime 失效）和已上传对象的哈希，
+    内容相同的文件改为服务端 copy_object，大小相同但内容变了的文件也能发现
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Lock
+
+from checkpoint import dump_json
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
+# 上传时写入对象的 user meta，copy_object 默认会一起复制
+HASH_META = 'x-oss-meta-mdx-hash'
+
+
+def hasher():
+    """按可用性依次选 xxh3-128、blake3、blake2b，返回 (算法名, 哈希对象)"""
+    if xxhash is not None:
+        return 'xxh3', xxhash.xxh3_128()
+    if blake3 is not None:
+        return 'blake3', blake3.blake3()
+    return 'blake2b', hashlib.blake2b(digest_size=16)
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    name, h = hasher()
+    with open(path, 'rb') as f:
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return f'{name}:{h.hexdigest()}'  # 带上算法名，换了算法的缓存不会误判相同
+
+
+class HashCache(object):
+    """
+    保存在 work_dir 下，结构：
+        files:   对象 key -> [size, mtime_ns, hash]，本地文件 stat 不变时直接用缓存的哈希
+        objects: hash -> 最近一次上传或确认过该内容的对象 key，用于 copy_object
+    加载时丢弃本地目录已经不存在的 chip。
+    """
+
+    def __init__(self, path, root, interval=30):
+        self.path = Path(path)
+        self.root = Path(root)
+        self.interval = interval
+        self.files = {}
+        self.objects = {}
+        self.last_save = 0
+        self.dirty = False
+        self.lock = Lock()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        chips = {}
+        for name, entry in data['files'].items():
+            chip = name.split('/', 1)[0]
+            if chips.setdefault(chip, (self.root / chip).is_dir()):
+                self.files[name] = entry
+        self.objects = data['objects']
+        logger.info(f'hash cache loaded, {len(self.files)} files, {len(self.objects)} objects')
+
+    def hash(self, path, name):
+        st = os.stat(path)
+        with self.lock:
+            entry = self.files.get(name)
+        if entry and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            return entry[2]
+        digest = file_hash(path)
+        with self.lock:
+            self.files[name] = [st.st_size, st.st_mtime_ns, digest]
+            self.dirty = True
+        self.save()
+        return digest
+
+    def lookup(self, digest):
+        with self.lock:
+            return self.objects.get(digest)
+
+    def remember(self, digest, name):
+        with self.lock:
+            self.objects[digest] = name
+            self.dirty = True
+        self.save()
+
+    def save(self, force=False):
+        with self.lock:
+            if not self.dirty and not force:
+                return
+            if not force and time.time() - self.last_save < self.interval:
+                return
+            dump_json({'files': self.files, 'objects': self.objects}, self.path)
+            self.last_save = time.time()
+            self.dirty = False
@@ -0,0 +1,27 @@
+"""
+    延迟导入：oss2 连同依赖导入约需 0.2 秒，模块顶部 from lazy import oss2 只创建代理，第一次访问属性时才真正导入，
+    --help、--dry-run 的本地部分等不连接 OSS 的调用不受影响
+"""
+
+import importlib
+from threading import Lock
+
+
+class LazyModule(object):
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+oss2 = LazyModule('oss2')
@@ -0,0 +1,227 @@
+"""
+    多节点 push 协调：用租约保证一个 chip（或 chip 的一个分片）同一时间只有一个节点在推送。
+
+    每个租约是一串递增编号的小对象 {name}/{gen}.json，只有第一个创建 gen+1 的节点成功（bucket 用
+    x-oss-forbid-overwrite，本地共享目录用 link），领取、续约、释放都是写下一个编号，所以不需要加锁的服务。
+    持有者定期续约；节点挂掉后租约超时，其他节点写下一个编号接管。判断超时用各节点本地时间，节点之间需要 NTP 同步。
+"""
+
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+import zlib
+from pathlib import Path
+from threading import Lock, Thread
+
+from lazy import oss2
+
+logger = logging.getLogger(__name__)
+
+FINAL = 'final'
+
+
+def shard_of(name, shards):
+    """文件按相对路径的 crc32 分到 shards 个分片中，所有节点的 --shards 必须一致"""
+    return zlib.crc32(name.encode()) % shards
+
+
+class LocalLeaseStore(object):
+    """租约保存在多个节点都挂载的共享目录里；先写临时文件再 link，目标已存在时 link 失败，NFS 上也是原子的"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, name, gen):
+        return self.root / name / f'{gen:010d}.json'
+
+    def generations(self, name):
+        try:
+            return sorted(int(x.split('.')[0]) for x in os.listdir(self.root / name) if x.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def read(self, name, gen):
+        try:
+            with open(self.path(name, gen)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def create(self, name, gen, data):
+        path = self.path(name, gen)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+        tmp.write_text(json.dumps(data))
+        try:
+            os.link(tmp, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink()
+
+    def delete(self, name, gen):
+        try:
+            self.path(name, gen).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class BucketLeaseStore(object):
+    """租约保存在目标 bucket 的 prefix 下，不需要额外的共享存储"""
+
+    def __init__(self, bucket, prefix='.mdx.leases/'):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, name, gen):
+        return f'{self.prefix}{name}/{gen:010d}.json'
+
+    def generations(self, name):
+        keys = oss2.ObjectIterator(self.bucket, prefix=f'{self.prefix}{name}/')
+        return sorted(int(x.key.rsplit('/', 1)[1].split('.')[0]) for x in keys if x.key.endswith('.json'))
+
+    def read(self, name, gen):
+        try:
+            return json.loads(self.bucket.get_object(self.key(name, gen)).read())
+        except (oss2.exceptions.NoSuchKey, ValueError):
+            return None
+
+    def create(self, name, gen, data):
+        try:
+            self.bucket.put_object(self.key(name, gen), json.dumps(data), headers={'x-oss-forbid-overwrite': 'true'})
+            return True
+        except oss2.exceptions.ServerError as e:
+            if e.status == 409:  # FileAlreadyExists
+                return False
+            raise
+
+    def delete(self, name, gen):
+        self.bucket.delete_object(self.key(name, gen))
+
+
+class Lease(object):
+    def __init__(self, name, gen):
+        self.name = name
+        self.chip, self.shard = name.rsplit('/', 1)
+        if self.shard != FINAL:
+            self.shard = int(self.shard)
+        self.gen = gen
+        self.lost = False
+
+
+class LeaseManager(object):
+    """
+    每个 chip 有 shards 个分片租约 {chip}/0 .. {chip}/{shards-1}；shards 大于 1 时还有一个 {chip}/final，
+    所有分片完成后才能领取，持有者负责推送 run 结束标记。
+
+    租约内容：{'node': 节点名, 'state': held / released / done, 'time': 写入时间, 'ttl': 秒}。
+    held 超过 ttl 未续约（包括本节点重启前留下的）或者 released 的可以被领取；done 的分片不再领取。
+    节点名默认为 主机名:进程号，同一台机器上的多个进程、重启前后的进程都是不同的节点。
+    续约时发现租约被接管，会调用 on_lost(lease)。
+    """
+
+    def __init__(self, store, node=None, ttl=600, shards=1):
+        self.store = store
+        self.node = node or f'{socket.gethostname()}:{os.getpid()}'
+        self.ttl = ttl
+        self.shards = shards
+        self.held = {}
+        self.on_lost = None
+        self.lock = Lock()
+
+    def names(self, chip):
+        names = [f'{chip}/{x}' for x in range(self.shards)]
+        if self.shards > 1:
+            names.append(f'{chip}/{FINAL}')
+        return names
+
+    def current(self, name):
+        gens = self.store.generations(name)
+        for gen in reversed(gens):
+            data = self.store.read(name, gen)
+            if data is not None:
+                return gen, data
+        return (gens[-1] if gens else 0), None
+
+    def claimable(self, name, gen, data):
+        if data is None:
+            return gen == 0  # 有编号但读不到内容时，当作刚被其他节点改写，不领取
+        if data['state'] == 'released':
+            return True
+        if data['state'] == 'held':
+            if name in self.held:
+                return False
+            return time.time() > data['time'] + data['ttl']  # 持有者可能还在推送，即使同名也要等超时
+        return False
+
+    def write(self, name, gen, state):
+        data = {'node': self.node, 'state': state, 'time': time.time(), 'ttl': self.ttl}
+        if not self.store.create(name, gen, data):
+            return False
+        if gen > 2:
+            self.store.delete(name, gen - 2)  # 只保留最近两个编号
+        return True
+
+    def is_done(self, name):
+        _, data = self.current(name)
+        return data is not None and data['state'] == 'done'
+
+    def chip_done(self, chip):
+        return self.is_done(self.names(chip)[-1])
+
+    def acquire(self, chip):
+        """按顺序领取一个可用的分片，没有时返回 None"""
+        for name in self.names(chip):
+            if name.endswith(f'/{FINAL}') and not all(self.is_done(x) for x in self.names(chip)[:-1]):
+                continue
+            gen, data = self.current(name)
+            if not self.claimable(name, gen, data):
+                continue
+            with self.lock:
+                if not self.write(name, gen + 1, 'held'):
+                    continue  # 被其他节点抢先
+                lease = Lease(name, gen + 1)
+                self.held[name] = lease
+            if data is not None and data['state'] == 'held' and data['node'] != self.node:
+                logger.warning(f'take over {name} from {data["node"]}, lease expired')
+            logger.info(f'acquired lease {name}')
+            return lease
+        return None
+
+    def renew(self, lease):
+        with self.lock:
+            if lease.lost or lease.name not in self.held:
+                return
+            if self.write(lease.name, lease.gen + 1, 'held'):
+                lease.gen += 1
+                return
+            lease.lost = True
+            self.held.pop(lease.name)
+        logger.error(f'lost lease {lease.name}, another node took it over')
+        if self.on_lost is not None:
+            self.on_lost(lease)
+
+    def release(self, lease, done=False):
+        with self.lock:
+            if lease.lost or lease.name not in self.held:
+                return
+            self.held.pop(lease.name)
+            if not self.write(lease.name, lease.gen + 1, 'done' if done else 'released'):
+                lease.lost = True
+                logger.error(f'lost lease {lease.name} before release')
+
+    def renew_loop(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            for lease in list(self.held.values()):
+                try:
+                    self.renew(lease)
+                except Exception as e:
+                    logger.warning(f'renew lease {lease.name} error, msg: {e}')  # 下一轮再试，超时前还有两次机会
+
+    def start(self):
+        Thread(target=self.renew_loop, daemon=True).start()
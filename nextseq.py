@@ -4,27 +4,129 @@
 
 from pathlib import Path
 from xml.etree import ElementTree
+from collections import namedtuple
+from queue import Queue
+from threading import Thread, Lock, Event
+import os
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# kind: bcl / bci / lane_bci / locs / filter / run_info / run_parameters / rta_configuration / rta_complete / rta_read_complete
+FileReady = namedtuple('FileReady', ['kind', 'lane', 'cycle', 'path', 'size'])
+
+
+class Stopped(Exception):
+    """等待中途被 stop 打断（如 EventStream.stop()）"""
+
+
+class ReadinessDetector(object):
+    """
+    判断文件是否写完：出现后按逐渐拉长的间隔采样 size 和 mtime，连续 quiet 秒（本机时钟）没有变化才算写完，
+    不依赖网络盘服务器的时钟。写完的小文件约 quiet 秒就绪，正在写的大 bcl 会一直等到不再变化。
+
+    追赶进行中的 run（首次推送、接管其他节点的租约）时大部分文件早已写完：后一个文件（successor，
+    如下一个 cycle 的 bcl）已经存在时直接就绪。其余文件即使开始等待时已经存在，也按 quiet 判断，
+    网络盘上的写入可能停顿超过一次采样间隔。
+
+    check_writers 为 True 时，稳定后还要求本机没有进程以写方式打开该文件（扫描 /proc/<pid>/fdinfo，
+    看不到的进程跳过）；测序仪通过网络盘写入时写进程不在本机，这一项不起作用。
+    """
+
+    def __init__(self, quiet=0.5, min_interval=0.05, check_writers=False):
+        self.quiet = quiet
+        self.min_interval = min_interval
+        self.check_writers = check_writers and os.path.isdir('/proc/self/fdinfo')
+
+    @staticmethod
+    def snapshot(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def open_for_write(path):
+        path = os.path.realpath(path)
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                for fd in os.listdir(f'/proc/{pid}/fd'):
+                    if os.readlink(f'/proc/{pid}/fd/{fd}') != path:
+                        continue
+                    with open(f'/proc/{pid}/fdinfo/{fd}') as f:
+                        flags = int(f.read().split('flags:')[1].split()[0], 8)
+                    if flags & (os.O_WRONLY | os.O_RDWR):
+                        return True
+            except (OSError, IndexError, ValueError):
+                continue  # 进程已退出或没有权限
+        return False
+
+    @staticmethod
+    def sleep(delay, stop=None):
+        if stop is None:
+            time.sleep(delay)
+        elif stop.wait(delay):
+            raise Stopped()
+
+    def wait_appear(self, path, interval, stop=None):
+        delay = min(0.2, interval)
+        while not os.path.exists(path):
+            self.sleep(delay, stop)
+            delay = min(delay * 1.5, interval)
+
+    def wait_ready(self, path, interval=10, stop=None, successor=None):
+        """interval 为等待文件出现时的最长轮询间隔；stop 为 threading.Event，被设置后抛出 Stopped"""
+        self.wait_appear(path, interval, stop)
+        if successor is not None and os.path.exists(successor):
+            return
+        last = self.snapshot(path)
+        stable_since = time.time()
+        delay = self.min_interval
+        while True:
+            self.sleep(delay, stop)
+            current = self.snapshot(path)
+            if current != last:
+                last = current
+                stable_since = time.time()
+                delay = self.min_interval
+                continue
+            if time.time() - stable_since < self.quiet:
+                delay = min(delay * 2, self.quiet / 2)
+                continue
+            if self.check_writers and self.open_for_write(path):
+                delay = self.quiet
+                continue
+            return
+
 
 class Sequence(object):
+    readiness = ReadinessDetector()
+
     def __init__(self, seqdir, lane: int=4):
         self.seq_dir = Path(seqdir).resolve()
         self.lane_count = int(lane)
         self.chip = self.seq_dir.name
+        self._cycle_count = (None, 9999)
 
     @property
     def cycle_count(self):
-        if not self.run_info_xml.exists():
+        """RunInfo.xml 只在 size 或 mtime 变化时重新解析，all_bcl_files 等会频繁调用"""
+        try:
+            st = self.run_info_xml.stat()
+        except FileNotFoundError:
             return 9999
-        tree = ElementTree.parse(self.run_info_xml)
-        count = 0
-        for read in tree.findall('./Run/Reads/Read'):
-            count += int(read.get('NumCycles', 0))
-        return count
+        key = (st.st_size, st.st_mtime_ns)
+        if self._cycle_count[0] != key:
+            tree = ElementTree.parse(self.run_info_xml)
+            count = 0
+            for read in tree.findall('./Run/Reads/Read'):
+                count += int(read.get('NumCycles', 0))
+            self._cycle_count = (key, count)
+        return self._cycle_count[1]
 
     def text_files(self):
         self.wait_file(self.rta_complete_txt)
@@ -40,43 +142,44 @@ class Sequence(object):
         self.wait_file(self.run_completion_status_xml)
         yield self.run_completion_status_xml
 
-    def iter_data_files(self):
-        self.wait_file(self.run_info_xml)
+    def iter_data_files(self, done=()):
+        """done 中的文件已经处理过（断点续传），不再等待，直接跳到下一个缺失的 cycle"""
+        self.wait_file(self.run_info_xml, done=done)
         yield self.run_info_xml
-        self.wait_file(self.run_parammeters_xml)
+        self.wait_file(self.run_parammeters_xml, done=done)
         yield self.run_parammeters_xml
 
         # lane level bci file
         for file in self.lane_bci_files:
-            self.wait_file(file)
+            self.wait_file(file, done=done)
             yield file
 
         # first 5 cycles
         for cycle in range(1, 6):
-            self.wait_cycle(cycle)
+            self.wait_cycle(cycle, done=done)
             for lane in range(1, self.lane_count + 1):
                 yield self.cycle_bcl_files(cycle, lane)
                 yield self.cycle_bcl_index_files(cycle, lane)
 
         # location files
-        self.wait_file(self.cycle_bcl_files(cycle=6, lane=1))  # cycle 6出现时location文件已经生成，且不再变动
+        self.wait_file(self.cycle_bcl_files(cycle=6, lane=1), done=done)  # cycle 6出现时location文件已经生成，且不再变动
         for file in self.location_files:
             yield file
 
         # 6 - last cycles
         this_cycle = 6
         while self.cycle_count >= this_cycle:
-            self.wait_cycle(this_cycle)
+            self.wait_cycle(this_cycle, done=done)
             for lane in range(1, self.lane_count + 1):
                 yield self.cycle_bcl_files(this_cycle, lane)
                 yield self.cycle_bcl_index_files(this_cycle, lane)
             if this_cycle == 25:  # 第25个cycle以后，出现filters文件
                 for file in self.filter_files:
-                    self.wait_file(file)
+                    self.wait_file(file, done=done)
                     yield file
             this_cycle += 1
         # wait till RTA complete
-        self.wait_file(self.rta_complete_txt)
+        self.wait_file(self.rta_complete_txt, done=done)
         yield self.rta_configuration_xml
         yield self.run_info_xml
         yield self.run_parammeters_xml
@@ -84,23 +187,69 @@ class Sequence(object):
         for x in self.rta_read_complete_txts:
             yield x
 
-    def wait_cycle(self, cycle, interval=30):
-        """等待cycle结束，bcl文件出现时会很快写完，每个bcl文件大小在50多M，第一个cycle出现时，RunInfo.xml就已经有了"""
-        logger.debug(f'wait cycle {cycle} ...')
+    def events(self, done=()):
+        """按 lane 并发的文件就绪事件流，见 EventStream"""
+        return EventStream(self, done=done)
+
+    def wait_cycle(self, cycle, interval=30, done=()):
+        """等待cycle结束：所有 lane 的 bcl 和 bci 都写完，每个bcl文件大小在50多M，第一个cycle出现时，RunInfo.xml就已经有了"""
         this_cycle_file = self.cycle_bcl_files(cycle=cycle, lane=1)
-        next_cycle_file = self.cycle_bcl_files(cycle=cycle + 1, lane=1)
-        while not this_cycle_file.exists():
-            time.sleep(interval)
-        if not next_cycle_file.exists():
-            time.sleep(interval)  # wait all cycle files to generated
+        if this_cycle_file in done:
+            return
+        logger.debug(f'wait cycle {cycle} ...')
+        for lane in range(1, self.lane_count + 1):
+            self.wait_file(self.cycle_bcl_files(cycle, lane), interval=interval, done=done)
+            self.wait_file(self.cycle_bcl_index_files(cycle, lane), interval=interval, done=done)
         logger.debug(f'cycle {cycle} finished')
 
-    def wait_file(self, file, interval=10):
-        logger.debug(f'wait {file} appear...')
-        while not Path(file).exists():
-            time.sleep(interval)
-        time.sleep(interval)  # wait file write done
-        logger.debug(f'{file} appeared')
+    @staticmethod
+    def successor(file):
+        """cycle 文件的下一个 cycle 的同类文件，它出现时这个文件已经写完；其他文件返回 None"""
+        file = Path(file)
+        cycle, dot, suffix = file.name.partition('.')
+        if not cycle.isdigit() or suffix not in ('bcl.bgzf', 'bcl.bgzf.bci'):
+            return None
+        return file.with_name(f'{str(int(cycle) + 1).zfill(len(cycle))}{dot}{suffix}')
+
+    def wait_file(self, file, interval=10, done=(), stop=None):
+        if Path(file) in done:
+            return
+        logger.debug(f'wait {file} ready...')
+        self.readiness.wait_ready(file, interval=interval, stop=stop, successor=self.successor(file))
+        logger.debug(f'{file} ready')
+
+    def classify(self, path):
+        """文件类别，数据文件与 FileReady.kind 一致，其余按所在目录归类"""
+        path = Path(path)
+        name = path.name
+        if name.endswith('.bcl.bgzf'):
+            return 'bcl'
+        if name.endswith('.bcl.bgzf.bci'):
+            return 'bci'
+        if name.endswith('.locs'):
+            return 'locs'
+        if name.endswith('.filter'):
+            return 'filter'
+        if name.endswith('.bci'):
+            return 'lane_bci'
+        try:
+            top = path.relative_to(self.seq_dir).parts[0]
+        except (ValueError, IndexError):
+            return 'other'
+        dirs = {
+            self.interop_dir.name: 'interop',
+            self.images_dir.name: 'images',
+            self.thumbnail_images_dir.name: 'thumbnails',
+            self.rtalogs_dir.name: 'rtalogs',
+            self.logs_dir.name: 'logs',
+            self.config_dir.name: 'config',
+            self.recipe_dir.name: 'recipe',
+        }
+        if top in dirs:
+            return dirs[top]
+        if name.endswith('.xml') or name.endswith('.txt'):
+            return 'run_files'
+        return 'other'
 
     def dynamic_paths(self):
         return [self.interop_dir]
@@ -240,3 +389,123 @@ class Sequence(object):
     @property
     def rta_configuration_xml(self):
         return self.seq_dir / 'RTAConfiguration.xml'
+
+
+class EventStream(object):
+    """
+    文件就绪事件流：每个 lane 一个线程独立等待自己的文件，某个 lane 写得慢不会挡住其他 lane。
+
+    订阅需在 start() 之前完成，每个订阅者拿到全部事件，所有文件都就绪后迭代结束。
+    done 与 iter_data_files 相同，其中的文件不再等待，直接发布。stop() 后各线程不再等待，订阅者的迭代随之结束。
+    某个线程出错时，订阅者的迭代抛出该异常，而不是当作全部就绪正常结束。
+    """
+
+    def __init__(self, seq: Sequence, done=()):
+        self.seq = seq
+        self.done = done
+        self.stopped = Event()
+        self.subscribers = []
+        self.running = 0
+        self.lock = Lock()
+
+    def subscribe(self):
+        queue = Queue()
+        with self.lock:
+            self.subscribers.append(queue)
+        return self.iter_queue(queue)
+
+    @staticmethod
+    def iter_queue(queue):
+        while True:
+            event = queue.get()
+            if event is None:
+                break
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def publish(self, kind, path, lane=None, cycle=None):
+        if self.stopped.is_set():
+            return
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            logger.warning(f'{path} not exists, skip')
+            return
+        event = FileReady(kind, lane, cycle, path, size)
+        with self.lock:
+            for queue in self.subscribers:
+                queue.put(event)
+
+    def start(self):
+        targets = [self.run_files] + [lambda lane=lane: self.lane_files(lane) for lane in range(1, self.seq.lane_count + 1)]
+        self.running = len(targets)
+        for target in targets:
+            Thread(target=self.worker, args=(target,), daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def worker(self, target):
+        try:
+            target()
+        except Stopped:
+            pass
+        except Exception as e:
+            logger.error(f'event stream of {self.seq.chip} error, msg: {e}')
+            self.stop()
+            with self.lock:
+                for queue in self.subscribers:
+                    queue.put(e)
+        finally:
+            with self.lock:
+                self.running -= 1
+                if self.running == 0:
+                    for queue in self.subscribers:
+                        queue.put(None)
+
+    def wait_file(self, file):
+        self.seq.wait_file(file, done=self.done, stop=self.stopped)
+
+    def run_files(self):
+        seq = self.seq
+        self.wait_file(seq.run_info_xml)
+        self.publish('run_info', seq.run_info_xml)
+        self.wait_file(seq.run_parammeters_xml)
+        self.publish('run_parameters', seq.run_parammeters_xml)
+        self.wait_file(seq.rta_complete_txt)
+        self.publish('rta_configuration', seq.rta_configuration_xml)  # 不是每个 run 都有，没有时 publish 跳过
+        self.publish('run_info', seq.run_info_xml)
+        self.publish('run_parameters', seq.run_parammeters_xml)
+        self.publish('rta_complete', seq.rta_complete_txt)
+        for file in seq.rta_read_complete_txts:
+            self.publish('rta_read_complete', file)
+
+    def lane_files(self, lane):
+        seq = self.seq
+        self.wait_file(seq.run_info_xml)
+        bci = seq.lane_bci_files[lane - 1]
+        self.wait_file(bci)
+        self.publish('lane_bci', bci, lane=lane)
+        cycle = 1
+        while seq.cycle_count >= cycle:
+            for kind, file in (('bcl', seq.cycle_bcl_files(cycle, lane)), ('bci', seq.cycle_bcl_index_files(cycle, lane))):
+                self.wait_file(file)
+                self.publish(kind, file, lane=lane, cycle=cycle)
+            if cycle == 6:  # cycle 6出现时location文件已经生成
+                file = seq.location_files[lane - 1]
+                self.wait_file(file)
+                self.publish('locs', file, lane=lane)
+            if cycle == 25:  # 第25个cycle以后，出现filters文件
+                file = seq.filter_files[lane - 1]
+                self.wait_file(file)
+                self.publish('filter', file, lane=lane)
+            cycle += 1
+        if seq.cycle_count < 6:  # cycle 数不足 6 或 25 时循环里不会发布，这里补上
+            file = seq.location_files[lane - 1]
+            self.wait_file(file)
+            self.publish('locs', file, lane=lane)
+        if seq.cycle_count < 25:
+            file = seq.filter_files[lane - 1]
+            self.wait_file(file)
+            self.publish('filter', file, lane=lane)
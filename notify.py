@@ -0,0 +1,160 @@
+"""
+    pull 端就绪通知：维护每个 run 的本地就绪清单，cycle / read 在本地下载完成时，
+    通过 hook 命令、FIFO 或本地 unix socket 通知下游（如提前开始拆分 read）
+"""
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import time
+from pathlib import Path
+from threading import Thread
+
+from checkpoint import dump_json
+
+logger = logging.getLogger(__name__)
+
+# 拆分一个 read 除了 bcl 之外还需要的 lane 级文件
+LANE_FILES = ('lane_bci', 'locs', 'filter')
+
+
+class ReadinessManifest(object):
+    """
+    保存在 run 目录下的 .mdx.ready.json，记录已就绪的 cycle、read 和 lane 级文件，以及发出过的事件。
+    重启后从文件恢复，已经通知过的 cycle / read 不会重复通知。
+    """
+
+    file_name = '.mdx.ready.json'
+
+    def __init__(self, chip_dir, reads):
+        self.chip_dir = Path(chip_dir)
+        self.path = self.chip_dir / self.file_name
+        self.data = {
+            'chip': self.chip_dir.name,
+            'reads': list(reads),
+            'cycles_ready': [],
+            'reads_ready': [],
+            'lane_files_ready': [],
+            'run_ready': False,
+            'events': [],
+        }
+        if self.path.exists():
+            with open(self.path) as f:
+                self.data.update(json.load(f))
+
+    def read_ranges(self):
+        start = 1
+        for number, cycles in enumerate(self.data['reads'], 1):
+            yield number, start, start + cycles - 1
+            start += cycles
+
+    def event(self, name, **kwargs):
+        event = {'event': name, 'chip': self.data['chip'], 'run_dir': str(self.chip_dir), 'time': time.time()}
+        event.update(kwargs)
+        self.data['events'].append(event)
+        return event
+
+    def check_reads(self):
+        events = []
+        if not all(x in self.data['lane_files_ready'] for x in LANE_FILES):
+            return events
+        ready = set(self.data['cycles_ready'])
+        for number, first, last in self.read_ranges():
+            if number in self.data['reads_ready']:
+                continue
+            if all(x in ready for x in range(first, last + 1)):
+                self.data['reads_ready'].append(number)
+                events.append(self.event('read', read=number, first_cycle=first, last_cycle=last))
+        return events
+
+    def cycle_done(self, cycle):
+        """返回新产生的事件"""
+        if cycle in self.data['cycles_ready']:
+            return []
+        self.data['cycles_ready'].append(cycle)
+        events = [self.event('cycle', cycle=cycle)] + self.check_reads()
+        self.save()
+        return events
+
+    def lane_files_done(self, kind):
+        if kind in self.data['lane_files_ready']:
+            return []
+        self.data['lane_files_ready'].append(kind)
+        events = self.check_reads()
+        self.save()
+        return events
+
+    def run_done(self):
+        if self.data['run_ready']:
+            return []
+        self.data['run_ready'] = True
+        events = [self.event('run')]
+        self.save()
+        return events
+
+    def save(self):
+        dump_json(self.data, self.path, indent=2)
+
+
+class Notifier(object):
+    """
+    事件以一行 json 发送：
+        hook:   后台执行命令，事件字段通过 MDX_EVENT、MDX_CHIP、MDX_CYCLE、MDX_READ、MDX_RUN_DIR 环境变量传入，json 在 MDX_JSON
+        fifo:   非阻塞写入命名管道，没有读端时丢弃
+        socket: 连接本地 unix socket 发送后关闭
+    通知失败只记日志，不影响下载。
+    """
+
+    def __init__(self, hook=None, fifo=None, socket_path=None):
+        self.hook = hook
+        self.fifo = fifo
+        self.socket_path = socket_path
+
+    def send(self, events):
+        for event in events:
+            logger.info(f'notify {event["event"]} of {event["chip"]}: {event.get("read") or event.get("cycle") or ""}')
+            line = json.dumps(event) + '\n'
+            if self.hook:
+                Thread(target=self.run_hook, args=(event, line), daemon=True).start()
+            if self.fifo:
+                self.write_fifo(line)
+            if self.socket_path:
+                self.write_socket(line)
+
+    def run_hook(self, event, line):
+        env = dict(os.environ)
+        env.update({
+            'MDX_EVENT': event['event'],
+            'MDX_CHIP': event['chip'],
+            'MDX_RUN_DIR': event['run_dir'],
+            'MDX_CYCLE': str(event.get('cycle', '')),
+            'MDX_READ': str(event.get('read', '')),
+            'MDX_JSON': line.strip(),
+        })
+        p = subprocess.run(self.hook, shell=True, env=env)
+        if p.returncode != 0:
+            logger.warning(f'hook exit with {p.returncode} for {event["event"]} of {event["chip"]}')
+
+    def write_fifo(self, line):
+        try:
+            fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            logger.debug(f'fifo {self.fifo} not ready, msg: {e}')  # 没有读端时 ENXIO
+            return
+        try:
+            os.write(fd, line.encode())
+        except OSError as e:
+            logger.warning(f'write fifo {self.fifo} error, msg: {e}')
+        finally:
+            os.close(fd)
+
+    def write_socket(self, line):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(5)
+                sock.connect(self.socket_path)
+                sock.sendall(line.encode())
+        except OSError as e:
+            logger.warning(f'send to socket {self.socket_path} error, msg: {e}')
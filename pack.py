@@ -0,0 +1,133 @@
+"""
+    小文件打包：把 Images、Thumbnail_Images、RTALogs 等目录打成少量 tar 对象，另存一个索引对象，
+    读取单个文件时按索引里的偏移做 range 请求
+"""
+
+import json
+import logging
+import os
+import tarfile
+import tempfile
+from pathlib import Path
+
+from lazy import oss2
+
+logger = logging.getLogger(__name__)
+
+PACK_SUFFIX = '.mdxpack'
+
+
+def volume_key(name, number):
+    return f'{name}.{number:03d}{PACK_SUFFIX}'
+
+
+def index_key(name):
+    return f'{name}{PACK_SUFFIX}.json'
+
+
+class PackWriter(object):
+    """
+    name 为目录在 bucket 中的 key（如 chip/Images），生成 chip/Images.000.mdxpack ... 和 chip/Images.mdxpack.json。
+
+    tar 不压缩，索引记录每个文件数据在卷中的偏移，可直接 range 读取。
+    卷先写到 tmp_dir 的临时文件，写满 volume_size 就上传并开始下一卷。
+    """
+
+    def __init__(self, bucket, volume_size=256 * 1024 * 1024, tmp_dir=None):
+        self.bucket = bucket
+        self.volume_size = volume_size
+        self.tmp_dir = tmp_dir
+
+    @staticmethod
+    def local_files(path):
+        files = {}
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for x in sorted(names):
+                file = Path(root) / x
+                st = file.stat()
+                files[file.relative_to(path).as_posix()] = (file, st.st_size, st.st_mtime_ns)
+        return files
+
+    def remote_index(self, name):
+        try:
+            return json.loads(self.bucket.get_object(index_key(name)).read())
+        except oss2.exceptions.NoSuchKey:
+            return None
+
+    def pack(self, path, name):
+        path = Path(path)
+        files = self.local_files(path)
+        index = self.remote_index(name)
+        if index and {k: v[2:] for k, v in index['members'].items()} == {k: [v[1], v[2]] for k, v in files.items()}:
+            logger.info(f'{name} already packed, skip')
+            return index
+        logger.info(f'Packing {path}, {len(files)} files...')
+        index = {'volumes': [], 'members': {}}
+        tar = None
+        tmp = None
+        for member, (file, size, mtime) in files.items():
+            if tar is None:
+                tmp = tempfile.TemporaryFile(dir=self.tmp_dir)
+                tar = tarfile.open(fileobj=tmp, mode='w', format=tarfile.PAX_FORMAT)
+                index['volumes'].append(volume_key(name, len(index['volumes'])))
+            info = tar.gettarinfo(str(file), arcname=member)
+            info.size = size  # 以 stat 时的大小为准，和索引保持一致
+            with open(file, 'rb') as f:
+                tar.addfile(info, f)
+            data_offset = tar.offset - (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+            index['members'][member] = [len(index['volumes']) - 1, data_offset, size, mtime]
+            if tar.offset >= self.volume_size:
+                self.upload_volume(tar, tmp, index['volumes'][-1])
+                tar = None
+        if tar is not None:
+            self.upload_volume(tar, tmp, index['volumes'][-1])
+        # 索引最后上传，读端看到索引时所有卷都已就绪
+        self.bucket.put_object(index_key(name), json.dumps(index))
+        logger.info(f'{name} packed into {len(index["volumes"])} volumes')
+        return index
+
+    def upload_volume(self, tar, tmp, key):
+        tar.close()
+        tmp.seek(0)
+        try:
+            self.bucket.put_object(key, tmp)
+        finally:
+            tmp.close()
+
+
+class PackReader(object):
+    """按索引读取打包目录中的文件，单个文件用 range 请求，整个目录按卷流式解包"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.index = json.loads(bucket.get_object(index_key(name)).read())
+
+    def members(self):
+        return list(self.index['members'])
+
+    def read(self, member):
+        volume, offset, size, _ = self.index['members'][member]
+        if size == 0:
+            return b''
+        return self.bucket.get_object(self.index['volumes'][volume], byte_range=(offset, offset + size - 1)).read()
+
+    def extract(self, member, dest_dir):
+        _, _, _, mtime = self.index['members'][member]
+        dest = Path(dest_dir) / member
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(self.read(member))
+        os.utime(dest, ns=(mtime, mtime))
+        return dest
+
+    def extract_all(self, dest_dir):
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        for key in self.index['volumes']:
+            with tarfile.open(fileobj=self.bucket.get_object(key), mode='r|') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(dest_dir, filter='data')
+                else:
+                    tar.extractall(dest_dir)
+        logger.info(f'{self.name} unpacked to {dest_dir}, {len(self.index["members"])} files')
@@ -0,0 +1,191 @@
+"""
+    --dry-run 传输计划：对比本地 run、远端对象和断点记录，列出需要传输的文件数、字节数、请求数，
+    并按记录的历史吞吐估算耗时
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from threading import Lock
+
+from checkpoint import dump_json
+from lazy import oss2
+from nextseq import Sequence
+from pack import index_key
+
+logger = logging.getLogger(__name__)
+
+
+def human_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+
+
+def human_time(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+
+
+def upload_requests(size):
+    """push_file 对一个文件发出的请求数：比对远端 1 次 + 上传 + 校验大小 1 次"""
+    if size >= oss2.defaults.multipart_threshold:
+        part_size = oss2.determine_part_size(size, preferred_size=oss2.defaults.part_size)
+        upload = math.ceil(size / part_size) + 2  # init + parts + complete
+    else:
+        upload = 1
+    return upload + 2
+
+
+class ThroughputLog(object):
+    """
+    记录最近 keep 次上传的字节数和耗时，估算时用总字节数 / 总耗时。
+    consumer 和重传线程都会记录，保存失败只打日志，不影响已经成功的上传。
+    """
+
+    def __init__(self, path, keep=500, interval=30):
+        self.path = Path(path)
+        self.keep = keep
+        self.interval = interval
+        self.samples = []
+        self.last_save = 0
+        self.lock = Lock()
+
+    def load(self):
+        if self.path.exists():
+            with open(self.path) as f:
+                self.samples = json.load(f)
+
+    def record(self, size, seconds):
+        with self.lock:
+            self.samples.append([int(time.time()), size, round(seconds, 3)])
+            del self.samples[:-self.keep]
+        self.save()
+
+    def save(self, force=False):
+        with self.lock:
+            if not force and time.time() - self.last_save < self.interval:
+                return
+            try:
+                dump_json(self.samples, self.path)
+            except OSError as e:
+                logger.warning(f'save throughput log error, msg: {e}')
+            self.last_save = time.time()
+
+    def rate(self):
+        with self.lock:
+            samples = list(self.samples)
+        total_size = sum(x[1] for x in samples)
+        total_time = sum(x[2] for x in samples)
+        if not total_size or not total_time:
+            return None
+        return total_size / total_time
+
+
+class TransferPlanner(object):
+    """task 为 PushTask，使用它的 src、bucket、checkpoint、force、pack 和 throughput"""
+
+    columns = ('files', 'bytes', 'requests', 'pending', 'pending_bytes')
+
+    def __init__(self, task):
+        self.task = task
+
+    def remote_sizes(self, chip):
+        return {obj.key: obj.size for obj in oss2.ObjectIterator(self.task.bucket, prefix=f'{chip}/')}
+
+    def plan(self, chip):
+        task = self.task
+        seq = Sequence(task.src / chip)
+        remote = self.remote_sizes(chip)
+        rows = defaultdict(lambda: dict.fromkeys(self.columns, 0))
+        skipped = {'ledger': 0, 'remote': 0}
+        packed = [x for x in seq.non_important_paths() if x.exists()] if task.pack else []
+        for path in packed:
+            name = path.relative_to(task.src).as_posix()
+            row = rows[seq.classify(path)]
+            if task.checkpoint.is_done(chip, name, path, mode='pack'):
+                skipped['ledger'] += 1
+                continue
+            size = sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+            row['requests'] += 1  # 读取远端索引
+            if index_key(name) in remote:
+                continue  # 索引一致时不会重新打包，这里按已上传估算
+            row['files'] += 1
+            row['bytes'] += size
+            row['requests'] += math.ceil(size / (256 * 1024 * 1024)) + 1
+
+        local = {}
+        for root, dirs, names in os.walk(seq.seq_dir):
+            dirs[:] = [x for x in dirs if Path(root) / x not in packed]
+            for x in names:
+                path = Path(root) / x
+                local[path] = path.stat().st_size
+        for path, size in local.items():
+            name = path.relative_to(task.src).as_posix()
+            row = rows[seq.classify(path)]
+            if task.checkpoint.is_done(chip, name, path):
+                skipped['ledger'] += 1
+            elif not task.force and remote.get(name) == size:
+                skipped['remote'] += 1
+                row['requests'] += 1
+            else:
+                row['files'] += 1
+                row['bytes'] += size
+                row['requests'] += upload_requests(size)
+
+        # 还没有写出来的数据文件，按同类文件的平均大小估算
+        if seq.run_info_xml.exists() and not seq.is_run_complete():
+            expected = seq.all_bcl_files + seq.all_bcl_index_files + seq.location_files + seq.filter_files + seq.lane_bci_files
+            sizes = defaultdict(list)
+            for path, size in local.items():
+                sizes[seq.classify(path)].append(size)
+            for path in expected:
+                if path in local:
+                    continue
+                kind = seq.classify(path)
+                average = sum(sizes[kind]) // len(sizes[kind]) if sizes[kind] else 0
+                rows[kind]['pending'] += 1
+                rows[kind]['pending_bytes'] += average
+                rows[kind]['requests'] += upload_requests(average)
+        return rows, skipped
+
+    def report(self, chips):
+        rate = self.task.throughput.rate()
+        total = dict.fromkeys(self.columns, 0)
+        for chip in chips:
+            rows, skipped = self.plan(chip)
+            state = 'in progress' if chip in self.task.checkpoint.in_progress() else 'new'
+            print(f'== {chip} ({state}) ==')
+            print(f'{"class":<12}{"files":>8}{"size":>12}{"requests":>10}{"pending":>9}{"est. size":>12}')
+            chip_total = dict.fromkeys(self.columns, 0)
+            for kind in sorted(rows):
+                row = rows[kind]
+                print(f'{kind:<12}{row["files"]:>8}{human_size(row["bytes"]):>12}{row["requests"]:>10}'
+                      f'{row["pending"]:>9}{human_size(row["pending_bytes"]):>12}')
+                for key in self.columns:
+                    chip_total[key] += row[key]
+            print(f'{"total":<12}{chip_total["files"]:>8}{human_size(chip_total["bytes"]):>12}'
+                  f'{chip_total["requests"]:>10}{chip_total["pending"]:>9}{human_size(chip_total["pending_bytes"]):>12}')
+            print(f'skipped: {skipped["ledger"]} in local ledger, {skipped["remote"]} already in bucket')
+            print()
+            for key in self.columns:
+                total[key] += chip_total[key]
+        print(f'{len(chips)} chips, {total["files"]} files ({human_size(total["bytes"])}) to upload now, '
+              f'{total["pending"]} files (~{human_size(total["pending_bytes"])}) not written yet, '
+              f'{total["requests"]} requests')
+        if rate:
+            now = total['bytes'] / rate
+            later = (total['bytes'] + total['pending_bytes']) / rate
+            print(f'estimated time: {human_time(now)} for files on disk, {human_time(later)} including pending files, '
+                  f'at {human_size(rate)}/s from {len(self.task.throughput.samples)} recorded uploads')
+        else:
+            print('estimated time: unknown, no throughput history yet')
@@ -8,7 +8,16 @@ import time
 from pathlib import Path
 import argparse
 import sys
+import configparser
 from xml.etree import ElementTree
+from remote import RemoteIndex, AdaptivePoller
+from fetch import RangedDownloader
+from pack import PackReader, PACK_SUFFIX
+from notify import ReadinessManifest, Notifier
+from cache import RunCache, GB
+from status import StatusIndex, PULL_INDEX
+from retry import classify, is_fatal, backoff
+from lazy import oss2
 
 
 logger = logging.getLogger(__name__)
@@ -31,6 +40,24 @@ else:
 
 ossutil = f'{ossutil} --config-file {script_dir}/config.ini'
 
+remote_indexes = {}
+
+downloaders = {}
+
+download_threads = 8
+
+poll_interval = (5, 300)
+
+notifier = Notifier()
+
+cache = None
+
+status = StatusIndex(script_dir / PULL_INDEX)
+
+max_retries = 8
+
+failed_objects = {}
+
 
 def load_history(args):
     global known_chips
@@ -47,10 +74,41 @@ def load_history(args):
     logger.info(f'data loaded, {len(known_chips)} chips already pulled')
 
 
+def ossutil_lister(bucket):
+    root = f'oss://{bucket}/'
+
+    def lister(prefix, marker=''):
+        cmd = f'{ossutil} ls -d {root}{prefix}'
+        if marker:
+            cmd += f' --marker {marker}'
+        output = os.popen(cmd).read()
+        return [x.strip()[len(root):] for x in output.split('\n') if x.startswith(root)]
+    return lister
+
+
+def get_remote_index(bucket):
+    if bucket not in remote_indexes:
+        remote_indexes[bucket] = RemoteIndex(ossutil_lister(bucket))
+    return remote_indexes[bucket]
+
+
+def get_downloader(bucket):
+    if bucket not in downloaders:
+        parser = configparser.ConfigParser()
+        parser.read(script_dir / 'config.ini')
+        try:
+            auth = oss2.Auth(parser['Credentials']['accessKeyID'], parser['Credentials']['accessKeySecret'])
+            endpoint = parser['Credentials']['endpoint']
+        except KeyError:
+            raise SystemExit('Invalid config file')
+        downloaders[bucket] = RangedDownloader(oss2.Bucket(auth, endpoint, bucket), num_threads=download_threads)
+    return downloaders[bucket]
+
+
 def get_all_chips(args):
-    cmd = f'{ossutil} ls -d oss://{args.bucket}/ '
-    output = os.popen(cmd).read()
-    return [get_chip(x) for x in output.split('\n') if x.startswith('oss://')]
+    index = get_remote_index(args.bucket)
+    index.refresh('')
+    return [get_chip(x) for x in index.names('') if x.endswith('/')]
 
 
 def get_chip(name):
@@ -79,7 +137,7 @@ def find_new_chip(args):
 
 def download(name, dest_dir, bucket):
     logger.info(f'Pulling {name}...')
-    cmd = f"{ossutil} cp oss://{bucket}/{name} {dest_dir}  -r -u --jobs 30 --parallel 30 "
+    cmd = f"{ossutil} cp oss://{bucket}/{name} {dest_dir}  -r -u --jobs 30 --parallel 30 --exclude '*{PACK_SUFFIX}*' "
     p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
                          stderr=subprocess.STDOUT, encoding='utf-8')
     for line in p.stdout:
@@ -90,63 +148,147 @@ def download(name, dest_dir, bucket):
     return p.returncode
 
 
-def is_file_exists(name, bucket):
-    cmd = f'{ossutil} ls -d oss://{bucket}/{name}'
-    output = os.popen(cmd).read()
-    for line in output.split('\n'):
-        if line.startswith('Object and Directory Number is: 0'):
-            return False
-    return True
+def download_object(name, dest_dir, bucket):
+    logger.info(f'Pulling {name}...')
+    get_downloader(bucket).download(name, Path(dest_dir) / name)
+
 
+def unpack(chip, dest_dir, bucket):
+    """push 端用 --pack 打包的目录，按卷流式下载并解包到原来的位置"""
+    index = get_remote_index(bucket)
+    index.refresh(f'{chip}/', full=True)
+    bucket_obj = get_downloader(bucket).bucket
+    for key in sorted(index.names(f'{chip}/')):
+        if not key.endswith(f'{PACK_SUFFIX}.json'):
+            continue
+        name = key[:-len(f'{PACK_SUFFIX}.json')]
+        logger.info(f'Unpacking {name}...')
+        PackReader(bucket_obj, name).extract_all(Path(dest_dir) / name)
 
-def wait_and_download(name, dest_dir, bucket):
-    off = False
-    while not is_file_exists(name, bucket):
-        if not off:
-            logger.info(f'Wait {name}...')
-            off = True
-        time.sleep(60)
-    download(name, dest_dir, bucket)
+
+def is_file_exists(name, bucket):
+    return get_remote_index(bucket).exists(name)
+
+
+def wait_and_download(name, dest_dir, bucket, poller=None):
+    if not is_file_exists(name, bucket):
+        logger.info(f'Wait {name}...')
+        poller = poller or AdaptivePoller(*poll_interval)
+        while True:
+            poller.wait()
+            if is_file_exists(name, bucket):
+                poller.changed()
+                break
+    if cache is not None:
+        cache.wait_for_space()
+    if get_remote_index(bucket).is_dir(name):
+        download(name, dest_dir, bucket)
+        return
+    for attempt in range(1, max_retries + 1):
+        try:
+            download_object(name, dest_dir, bucket)
+            status.record(name, 'pulled')
+            return
+        except Exception as e:
+            # 分段多次失败、CRC64 不一致，或下载中 push 重传了对象（If-Match 412）时退避后重新 HEAD 再下载；
+            # 对象已经列出来过，这时的 404、403 等 4xx 重试也不会成功
+            if is_fatal(e) or attempt == max_retries:
+                logger.error(f'Pull {name} failed ({attempt} attempts), give up, msg: {e}')
+                break
+            delay = backoff(attempt - 1, classify(e), max_delay=poll_interval[1])
+            logger.warning(f'Pull {name} error ({attempt}/{max_retries}), retry after {delay:.0f}s, msg: {e}')
+            time.sleep(delay)
+    failed_objects.setdefault(name.split('/', 1)[0], []).append(name)
 
 
 def get_cycle_number(xmlf):
-    root = ElementTree.parse(xmlf).getroot()
-    count = 0
-    for read in root.findall('./Run/Reads/Read'):
-        count += int(read.get('NumCycles', 0))
-    return count
+    return sum(get_read_cycles(xmlf))
 
 
-def download_data(chip, dest_dir, bucket):
-    wait_and_download(f'{chip}/Config', dest_dir, bucket)
-    wait_and_download(f'{chip}/Recipe', dest_dir, bucket)
-    wait_and_download(f'{chip}/RunInfo.xml', dest_dir, bucket)
-    cycles = get_cycle_number(dest_dir / chip / 'RunInfo.xml')
+def get_read_cycles(xmlf):
+    root = ElementTree.parse(xmlf).getroot()
+    return [int(read.get('NumCycles', 0)) for read in root.findall('./Run/Reads/Read')]
 
+
+def download_lane_files(chip, dest_dir, bucket, poller, kind, manifest):
+    paths = {
+        'lane_bci': 'Data/Intensities/BaseCalls/L00{lane}/s_{lane}.bci',
+        'locs': 'Data/Intensities/L00{lane}/s_{lane}.locs',
+        'filter': 'Data/Intensities/BaseCalls/L00{lane}/s_{lane}.filter',
+    }
     for lane in range(1, 5):
-        for cycle in range(1, cycles + 1):
-            wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/{str(cycle).zfill(4)}.bcl.bgzf', dest_dir, bucket)
-            wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/{str(cycle).zfill(4)}.bcl.bgzf.bci', dest_dir, bucket)
-            wait_and_download(f'{chip}/InterOp', dest_dir, bucket)
-    for lane in range(1, 5):
-        wait_and_download(f'{chip}/Data/Intensities/L00{lane}/s_{lane}.locs', dest_dir, bucket)
-        wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/s_{lane}.bci', dest_dir, bucket)
-        wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/s_{lane}.filter', dest_dir, bucket)
+        wait_and_download(f'{chip}/' + paths[kind].format(lane=lane), dest_dir, bucket, poller)
+    notifier.send(manifest.lane_files_done(kind))
+
+
+def download_data(chip, dest_dir, bucket):
+    poller = AdaptivePoller(*poll_interval)  # 同一个 chip 共用，记录 cycle 的到达间隔
+    wait_and_download(f'{chip}/Config', dest_dir, bucket, poller)
+    wait_and_download(f'{chip}/Recipe', dest_dir, bucket, poller)
+    wait_and_download(f'{chip}/RunInfo.xml', dest_dir, bucket, poller)
+    reads = get_read_cycles(dest_dir / chip / 'RunInfo.xml')
+    cycles = sum(reads)
+    status.set_layout(chip, cycles)
+    manifest = ReadinessManifest(dest_dir / chip, reads)
+    if cache is not None:
+        cache.reserve(chip, cycles)
+
+    # 与 push 的上传顺序一致：按 cycle 下载，每个 cycle 4 个 lane 都到齐后通知
+    download_lane_files(chip, dest_dir, bucket, poller, 'lane_bci', manifest)
+    for cycle in range(1, cycles + 1):
+        for lane in range(1, 5):
+            wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/{str(cycle).zfill(4)}.bcl.bgzf', dest_dir, bucket, poller)
+            wait_and_download(f'{chip}/Data/Intensities/BaseCalls/L00{lane}/{str(cycle).zfill(4)}.bcl.bgzf.bci', dest_dir, bucket, poller)
+        wait_and_download(f'{chip}/InterOp', dest_dir, bucket, poller)
+        if cycle == 6:  # cycle 6 之前 locs 已经上传
+            download_lane_files(chip, dest_dir, bucket, poller, 'locs', manifest)
+        if cycle == 25:  # 第25个cycle以后，出现filters文件
+            download_lane_files(chip, dest_dir, bucket, poller, 'filter', manifest)
+        notifier.send(manifest.cycle_done(cycle))
+    if cycles < 6:
+        download_lane_files(chip, dest_dir, bucket, poller, 'locs', manifest)
+    if cycles < 25:
+        download_lane_files(chip, dest_dir, bucket, poller, 'filter', manifest)
+    return manifest
 
 
 def download_till_finish(name, dest_dir, bucket):
     dest_dir = Path(dest_dir)
     logger.info(f'download loop started for chip: {name}')
-    download_data(name, dest_dir, bucket)
+    manifest = download_data(name, dest_dir, bucket)
     while not is_sequencing_finisehd(dest_dir / name):
         download(name, dest_dir, bucket)
         time.sleep(30)
+    failed = failed_objects.pop(name, [])
+    if failed:
+        # 不记入 known_chips，下一轮发现新 chip 时重新拉取，已经下载的文件会跳过
+        logger.error(f'{len(failed)} objects of {name} failed, pull it again later: {failed}')
+        return
+    unpack(name, dest_dir, bucket)
+    if cache is not None:
+        cache.finish(name)
+    status.finish(name)
+    notifier.send(manifest.run_done())
     logger.info('sequence finished, stop pulling')
     known_chips[name] = 1
     with open(history_file, 'w') as f:
         json.dump(known_chips, f, indent=2)
 
 
+def fetch_chip(name, dest_dir, bucket):
+    """按需重新拉取一个已经结束、但被缓存淘汰的 run"""
+    dest_dir = Path(dest_dir)
+    logger.info(f'fetch {name} on demand')
+    wait_and_download(f'{name}/RunInfo.xml', dest_dir, bucket)
+    if cache is not None:
+        cache.reserve(name, get_cycle_number(dest_dir / name / 'RunInfo.xml'))
+    if download(name, dest_dir, bucket) != 0:
+        raise SystemExit(f'fetch {name} failed')
+    unpack(name, dest_dir, bucket)
+    if cache is not None:
+        cache.finish(name)
+
+
 def is_sequencing_finisehd(chip_dir):
     chip_dir = Path(chip_dir)
     done_flag = chip_dir / 'RunCompletionStatus.xml'
@@ -188,14 +330,28 @@ def main():
         logging.basicConfig(level=level, format=formatstr)
 
     logger.info('program start')
+    global poll_interval, download_threads, notifier, cache, max_retries
+    poll_interval = (args.min_interval, args.interval)
+    max_retries = args.max_retries
+    download_threads = args.threads
+    notifier = Notifier(hook=args.notify_cmd, fifo=args.notify_fifo, socket_path=args.notify_socket)
+    cache = RunCache(args.dest, budget=args.cache_size * GB if args.cache_size else None, min_free=args.min_free * GB)
+    cache.load(finished=lambda chip: is_sequencing_finisehd(args.dest / chip))
+    status.load()
+    if args.fetch:
+        for chip in args.fetch:
+            fetch_chip(chip, args.dest, args.bucket)
+        return
     load_history(args)
+    poller = AdaptivePoller(*poll_interval)
     while True:
         logger.debug('loop start')
         new_chips = find_new_chip(args)
         for chip in new_chips:
             download_till_finish(chip, args.dest, args.bucket)
-        logger.debug(f'wait {args.interval}s for next loop')
-        time.sleep(args.interval)
+        if new_chips:
+            poller.changed()
+        poller.wait()
 
 
 def arg_handle():
@@ -205,8 +361,28 @@ def arg_handle():
     parser.add_argument('-v', '--verbose', dest="verbose", help='output all log info',
                         action='store_true', default=False)
     parser.add_argument('--bucket', metavar='bucket', help='bucket name', required=True)
-    parser.add_argument('--interval', metavar='int', help='wait how many seconds between two loop',
+    parser.add_argument('--interval', metavar='int', help='max seconds between two remote polls when idle',
                         default=300, type=int)
+    parser.add_argument('--min-interval', metavar='int', dest='min_interval',
+                        help='min seconds between two remote polls when a cycle is due', default=5, type=int)
+    parser.add_argument('--max-retries', metavar='int', dest='max_retries', type=int, default=8,
+                        help='max attempts to download one object before giving up on it')
+    parser.add_argument('--threads', metavar='int', help='connections per file for ranged downloads',
+                        default=8, type=int)
+    parser.add_argument('--cache-size', metavar='GB', dest='cache_size', type=float,
+                        help='size budget of dest_dir, evict runs with .analysis_done first, then the ones least '
+                             'recently pulled or marked in use by touching <run>/.analysis_access')
+    parser.add_argument('--min-free', metavar='GB', dest='min_free', type=float, default=10,
+                        help='pause downloads while free space of dest_dir is below this')
+    parser.add_argument('--fetch', metavar='chip', action='append',
+                        help='pull these finished chips again (e.g. evicted ones) and exit')
+    parser.add_argument('--notify-cmd', metavar='cmd', dest='notify_cmd',
+                        help='command to run when a cycle or read is ready locally, '
+                             'event passed in MDX_EVENT/MDX_CHIP/MDX_CYCLE/MDX_READ/MDX_RUN_DIR/MDX_JSON')
+    parser.add_argument('--notify-fifo', metavar='file', dest='notify_fifo',
+                        help='named pipe to write json events to')
+    parser.add_argument('--notify-socket', metavar='file', dest='notify_socket',
+                        help='unix socket to send json events to')
     return parser.parse_args()
 
 
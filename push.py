@@ -8,18 +8,23 @@ import time
 from pathlib import Path
 import argparse
 import sys
-from nextseq import Sequence
+from nextseq import Sequence, ReadinessDetector
+from checkpoint import Checkpoint, dump_json
+from retry import RetryQueue
+from watch import DirWatcher
+from pack import PackWriter
+from plan import ThroughputLog, TransferPlanner
+from zerocopy import SendfileUploader
+from dedup import HashCache, HASH_META
+from status import StatusIndex, PUSH_INDEX
+from lease import shard_of, FINAL, LeaseManager, LocalLeaseStore, BucketLeaseStore
 import hashlib
 from threading import Thread
 from queue import PriorityQueue
 import signal
 import configparser
 import base64
-
-
-import oss2
-from oss2 import SizedFileAdapter, determine_part_size
-from oss2.models import PartInfo
+from lazy import oss2
 
 
 logger = logging.getLogger(__name__)
@@ -45,6 +50,7 @@ class PushTask(object):
     history_file = os.path.join(script_dir, ".mdx.push.json")
     new_chips = PriorityQueue()
     current_chip = 'NULL'
+    src_mtime = None
     exit_stat = False
     failed_files = []
     keyid = ""
@@ -52,16 +58,35 @@ class PushTask(object):
     endpoint = ""
     auth = None
     bucket = None
+    held_leases = ()
+    shard_spread = 5
+    stream = None
+    probe_key = '.mdx.probe'
+    _seq = None
 
     def __init__(self, src, bucket, work_dir=".", history_file=".mdx.push.json",
-                 configfile="config.ini", dry_run=False, force=False):
+                 configfile="config.ini", dry_run=False, force=False, checkpoint_file=".mdx.push.ckpt.json",
+                 max_retries=8, pack=False, throughput_file=".mdx.push.throughput.json",
+                 lease_store=None, lease_ttl=600, shards=1, node=None, sendfile=False,
+                 dedup=False, hash_file=".mdx.push.hashes.json"):
         self.src = Path(src).resolve()
         self.bucket_name = bucket
         self.work_dir = work_dir
         self.history_file = Path(work_dir) / history_file
+        self.checkpoint = Checkpoint(Path(work_dir) / checkpoint_file)
+        self.retries = RetryQueue(self.retry_file, max_attempts=max_retries)
+        self.pack = pack
+        self.throughput = ThroughputLog(Path(work_dir) / throughput_file)
         self.config_file = Path(work_dir) / configfile
         self.dry_run = dry_run
         self.force = force
+        self.lease_store = lease_store  # 'bucket' 或共享目录，多节点推送时使用
+        self.lease_options = dict(ttl=lease_ttl, shards=shards, node=node)
+        self.leases = None
+        self.sendfile = sendfile
+        self.uploader = None
+        self.hashes = HashCache(Path(work_dir) / hash_file, self.src) if dedup else None
+        self.status = StatusIndex(Path(work_dir) / PUSH_INDEX)
 
     def check_config(self):
         parser = configparser.ConfigParser()
@@ -73,64 +98,146 @@ class PushTask(object):
             self.auth = oss2.Auth(self.keyid, self.keysec)
             self.bucket = oss2.Bucket(self.auth, self.endpoint,
                                       self.bucket_name)
-            self.bucket.list_objects()
         except Exception:
             raise SystemExit('Invalid config file')
+        # 用一次 HEAD 验证 endpoint、bucket 和密钥，探测的 key 不存在（404）说明都没问题
+        try:
+            self.bucket.head_object(self.probe_key)
+        except oss2.exceptions.NotFound as e:
+            if e.code == 'NoSuchBucket':
+                raise SystemExit(f'Bucket {self.bucket_name} not found')
+        except Exception as e:
+            raise SystemExit(f'Invalid config file, msg: {e}')
 
-    def load_history(self):
+    def load_history(self, save=True):
         logger.info('loading history data...')
         if not self.history_file.exists():
             logger.info(f'no history data, mark all names in {self.src} as known')
             all_names = os.listdir(self.src)
-            self.known_chips = {x: 0 for x in all_names}
-            with open(self.history_file, 'w') as f:
-                json.dump(self.known_chips, f, indent=2)
+            in_progress = self.checkpoint.in_progress()  # 断点中的 chip 没有推完，不能标记为已知
+            self.known_chips = {x: 0 for x in all_names if x not in in_progress}
+            if save:
+                dump_json(self.known_chips, self.history_file, indent=2)
             return
         with open(self.history_file) as f:
             self.known_chips = json.load(f)
         logger.info('data loaded, {0} chips already pushed'.format(len(self.known_chips)))
 
+    def resume(self):
+        for chip in self.checkpoint.in_progress():
+            if chip in self.known_chips:
+                self.checkpoint.finish(chip)  # 推送完成后、清理断点前被中断
+                continue
+            if chip in self.queued_chips:
+                continue
+            if not (self.src / chip).is_dir():
+                logger.warning(f'{chip} in checkpoint but not found in {self.src}, drop it')
+                self.checkpoint.finish(chip)
+                continue
+            logger.info(f'resume {chip} from checkpoint')
+            self.new_chips.put((0, chip))  # 优先于新 chip
+            self.queued_chips.add(chip)
+
     @property
     def chip_dir(self):
         return self.src / self.current_chip
 
     @property
     def seq(self):
-        return Sequence(self.chip_dir)
-
-    def find_new_chip(self):
+        if self._seq is None or self._seq.chip != self.current_chip:
+            self._seq = Sequence(self.chip_dir)  # 每个 chip 只建一次，RunInfo.xml 的解析结果随之复用
+        return self._seq
+
+    def find_new_chip(self, force=False):
+        mtime = os.stat(self.src).st_mtime_ns
+        if not force and mtime == self.src_mtime:
+            return  # 根目录没有增删，不用扫描
+        self.src_mtime = mtime
         logger.info('finding new chip...')
-        chips = os.listdir(self.src)
-        valid_chips = [x for x in chips if (self.src / x).is_dir() and len(x.split('_')) == 4]
+        valid_count = 0
         count = 0
-        for x in valid_chips:
-            if x not in self.known_chips and x not in self.queued_chips:
-                self.new_chips.put((10, x))
-                self.queued_chips.add(x)
-                count += 1
-        logger.info(f'found {len(valid_chips)} valid chips, {count} new chips, {len(self.queued_chips)} queued chips')
+        with os.scandir(self.src) as entries:
+            for entry in entries:
+                # 先按名字过滤；is_dir() 直接用 readdir 返回的 d_type，不额外 stat
+                if len(entry.name.split('_')) != 4 or not entry.is_dir():
+                    continue
+                valid_count += 1
+                if entry.name not in self.known_chips and entry.name not in self.queued_chips:
+                    self.new_chips.put((10, entry.name))
+                    self.queued_chips.add(entry.name)
+                    count += 1
+        logger.info(f'found {valid_count} valid chips, {count} new chips, {len(self.queued_chips)} queued chips')
+
+    def owns(self, name):
+        """多节点分片时，只推送属于本节点持有的租约的文件；run 结束标记归 final 租约"""
+        if self.leases is None:
+            return True
+        shards = {x.shard for x in self.held_leases if not x.lost}  # 被其他节点接管的分片，剩下的文件交给对方
+        if not shards:
+            return False
+        if self.leases.shards == 1:
+            return True
+        if name == self.seq.run_completion_status_xml.relative_to(self.src).as_posix():
+            return FINAL in shards
+        return shard_of(name, self.leases.shards) in shards
+
+    def lease_lost(self):
+        """持有的租约全部被接管"""
+        return bool(self.held_leases) and all(x.lost for x in self.held_leases)
+
+    def on_lease_lost(self, lease):
+        """续约线程发现租约被接管：停止等待后续文件，不再占着 consumer 等到 run 结束"""
+        stream = self.stream
+        if self.lease_lost() and stream is not None:
+            stream.stop()
 
     def push_path(self, path, force=None):
+        """返回是否已经全部推送完成，交给重传队列或属于其他节点的文件不算"""
         path = Path(path)
         if path.is_dir():
-            self.push_dir(path, force=force)
-        else:
-            self.push_file(path, force=force)
+            return self.push_dir(path, force=force)
+        return self.push_file(path, force=force)
 
     def push_dir(self, path, force=None):
         logger.info(f'Pushing {path}...')
         path = Path(path)
+        ok = True
         for sub in os.listdir(path):
             sub = path / sub
-            if sub.is_dir():
-                self.push_dir(sub, force=force)
+            if self.pack and sub in self.seq.non_important_paths():
+                ok = self.push_pack(sub) and ok
+            elif sub.is_dir():
+                ok = self.push_dir(sub, force=force) and ok
             else:
-                self.push_file(sub, force=force)
+                ok = self.push_file(sub, force=force) and ok
+        if ok:
+            # 目录下的文件都完成才记录；之后有文件失败重传成功时，下次推送这个目录会补上
+            self.checkpoint.mark(self.current_chip, path.relative_to(self.src).as_posix(), path)
+        return ok
+
+    def push_pack(self, path):
+        """小文件目录打包成少量 tar 对象上传"""
+        path = Path(path)
+        if not path.exists():
+            return True
+        name = path.relative_to(self.src).as_posix()
+        if not self.owns(name):
+            return False
+        if self.checkpoint.is_done(self.current_chip, name, path, mode='pack'):
+            return True
+        try:
+            PackWriter(self.bucket, tmp_dir=self.work_dir).pack(path, name)
+            self.checkpoint.mark(self.current_chip, name, path, mode='pack')
+            return True
+        except Exception as e:
+            logger.error(f'Pack {path} error, msg: {e}')
+            self.failed_files.append(path)
+            return False
 
     def push_by_piece(self, path, name):
         path = Path(path)
         total_size = path.stat().st_size
-        part_size = determine_part_size(total_size, preferred_size=1024 * 1024)
+        part_size = oss2.determine_part_size(total_size, preferred_size=1024 * 1024)
         upload_id = self.bucket.init_multipart_upload(name).upload_id
         parts = []
         with open(path, 'rb') as fileobj:
@@ -140,16 +247,16 @@ class PushTask(object):
                 num_to_upload = min(part_size, total_size - offset)
                 # SizedFileAdapter(fileobj, size)方法会生成一个新的文件对象，重新计算起始追加位置。
                 result = self.bucket.upload_part(name, upload_id, part_number,
-                                                 SizedFileAdapter(fileobj,
-                                                                  num_to_upload))
-                parts.append(PartInfo(part_number, result.etag))
+                                                 oss2.SizedFileAdapter(fileobj,
+                                                                       num_to_upload))
+                parts.append(oss2.models.PartInfo(part_number, result.etag))
                 offset += num_to_upload
                 part_number += 1
         headers = {'Content-MD5': self.get_md5(path)}
         self.bucket.complete_multipart_upload(name, upload_id, parts, headers=headers)
 
     def check_size(self, path, name):
-        obj = self.bucket.get_object(name)
+        obj = self.bucket.head_object(name)
         if obj.content_length != path.stat().st_size:
             raise ValueError(f'file size error, remote({obj.content_length}) != local({path.stat().st_size})')
 
@@ -159,19 +266,88 @@ class PushTask(object):
         name = path.relative_to(self.src).as_posix()
         if force is None:
             force = self.force  # local force 有高优先级
+        if not self.owns(name):
+            return False
+        if path == self.seq.run_info_xml:
+            self.status.set_layout(self.current_chip, self.seq.cycle_count, self.seq.lane_count)
+        if self.checkpoint.is_done(self.current_chip, name, path):
+            return True  # 断点前已经推送完成，且本地文件没有变化
+        self.status.record(name, 'on_disk')
+        if self.retries.breaker.is_open:
+            self.retries.submit(path)  # 熔断期间直接交给重传队列，不占用主流程
+            return False
         try:
-            remoteobj = self.bucket.get_object(name)
-            if not force and not self.force and remoteobj.content_length == path.stat().st_size:
-                return
-        except oss2.exceptions.NoSuchKey:
-            pass
-
-        try:
-            oss2.resumable_upload(self.bucket, name, filename=str(path), num_threads=3)
-            self.check_size(path, name)
+            digest = self.hashes.hash(path, name) if self.hashes else None
+            try:
+                remoteobj = self.bucket.head_object(name)
+                remote_hash = remoteobj.headers.get(HASH_META)
+                if digest and remote_hash == digest:
+                    # 内容相同，--force 时也不重传
+                    self.hashes.remember(digest, name)
+                    self.status.record(name, 'verified')
+                    self.checkpoint.mark(self.current_chip, name, path)
+                    return True
+                # 远端没有哈希（开启 --dedup 前上传的）时，仍然只能比较大小
+                if not force and not self.force and remoteobj.content_length == path.stat().st_size \
+                        and (digest is None or remote_hash is None):
+                    self.status.record(name, 'verified')
+                    self.checkpoint.mark(self.current_chip, name, path)
+                    return True
+            except oss2.exceptions.NotFound:  # HEAD 没有响应体，错误码不一定能解析成 NoSuchKey
+                pass
+            self.upload_file(path, name, digest)
+            self.retries.breaker.success()
+            return True
         except Exception as e:
             logger.error(f'Push {path} error, msg: {e}')
-            self.failed_files.append(path)
+            self.retries.breaker.failure()
+            self.retries.submit(path, e)
+            return False
+
+    def upload_file(self, path, name, digest=None):
+        headers = None
+        if self.hashes is not None:
+            digest = digest or self.hashes.hash(path, name)
+            headers = {HASH_META: digest}
+        copied = digest is not None and self.copy_existing(path, name, digest)
+        if not copied:
+            start = time.time()
+            if self.sendfile:
+                if self.uploader is None:
+                    self.uploader = SendfileUploader(self.bucket)
+                self.uploader.upload(path, name, headers=headers)
+            else:
+                oss2.resumable_upload(self.bucket, name, filename=str(path), headers=headers, num_threads=3)
+            self.throughput.record(path.stat().st_size, time.time() - start)
+        self.status.record(name, 'uploaded')
+        self.check_size(path, name)
+        self.status.record(name, 'verified')
+        if digest:
+            self.hashes.remember(digest, name)
+        self.checkpoint.mark(name.split('/', 1)[0], name, path)
+
+    def copy_existing(self, path, name, digest):
+        """远端已有相同内容的对象（如 run 目录改名或复制）时，用服务端复制代替上传"""
+        src = self.hashes.lookup(digest)
+        size = path.stat().st_size
+        if src is None or src == name or size >= 1024 ** 3:  # copy_object 只支持 1 GB 以内的对象
+            return False
+        try:
+            obj = self.bucket.head_object(src)
+        except oss2.exceptions.NotFound:
+            return False
+        if obj.headers.get(HASH_META) != digest or obj.content_length != size:
+            return False  # 源对象之后被覆盖或删除过
+        self.bucket.copy_object(self.bucket.bucket_name, src, name)  # 默认连同 user meta 一起复制
+        logger.info(f'{name} has the same content as {src}, copied on server')
+        return True
+
+    def retry_file(self, path):
+        self.upload_file(path, path.relative_to(self.src).as_posix())
+
+    def wait_retries(self):
+        self.retries.drain()
+        self.failed_files.extend(self.retries.pop_failed())
 
     @staticmethod
     def get_md5(file):
@@ -180,48 +356,75 @@ class PushTask(object):
             return ""
         hashobj = hashlib.md5()
         hashobj.update(file.read_bytes())
-        return base64.b64encode(hashobj.digest())
+        return base64.b64encode(hashobj.digest()).decode()
 
     def push(self):
+        """返回是否走完了整个流程；等待文件出错或租约丢失时返回 False，这时不能把 chip 当作完成"""
         logger.info(f'Push {self.current_chip}...')
         self.failed_files = []  # 清空错误列表
+        self.checkpoint.start(self.current_chip)
+        done = self.checkpoint.done_paths(self.current_chip, self.src)
         if self.seq.is_file_complete() and self.seq.is_run_complete() and self.seq.is_rta_complete():
             logger.info('Sequencing finished, push all...')
             self.push_path(self.chip_dir)
+            self.wait_retries()
             logger.info('Push done!')
         else:
             # push 配置文件
-            self.seq.wait_file(self.seq.recipe_dir)
+            self.seq.wait_file(self.seq.recipe_dir, done=done)
             self.push_path(self.seq.recipe_dir)
 
-            self.seq.wait_file(self.seq.config_dir)
+            self.seq.wait_file(self.seq.config_dir, done=done)
             self.push_path(self.seq.config_dir)
-            # push data目录
+            # push data目录：按文件就绪顺序上传，某个 lane 写得慢不会挡住其他 lane
+            stream = self.seq.events(done=done)
+            self.stream = stream
+            events = stream.subscribe()
+            if self.lease_lost():
+                stream.stop()
+            stream.start()
             count = 0
-            for path in self.seq.iter_data_files():
-                self.push_path(path)
-                count += 1
-                if count % 16 == 0:
-                    self.push_path(self.seq.interop_dir)  # 每2个cycle push一次 interop
+            try:
+                for event in events:
+                    self.push_path(event.path)
+                    count += 1
+                    if count % 16 == 0:
+                        self.push_path(self.seq.interop_dir)  # 每2个cycle push一次 interop
+            except Exception as e:
+                logger.error(f'wait files of {self.current_chip} error, push it later, msg: {e}')
+                return False
+            finally:
+                self.stream = None
+            if self.lease_lost():
+                logger.warning(f'lease of {self.current_chip} lost, stop pushing it')
+                return False
 
             for path in self.seq.non_important_paths():
-                self.push_path(path)
+                if self.pack:
+                    self.push_pack(path)
+                else:
+                    self.push_path(path)
 
             self.push_path(self.seq.interop_dir)  # 最后再push一次interop
 
-            # push again failed files
-            push_error = self.failed_files.copy()
-            self.failed_files = []
-            for path in push_error:
-                self.push_path(path, force=True)
-            if len(self.failed_files) != 0:
-                logger.error(f'{len(self.failed_files)} push failed， they are: {self.failed_files}')
+            # 等待后台重传结束，之后才能push run结束的标记
+            self.wait_retries()
 
             self.push_path(self.seq.run_completion_status_xml)  # 最最后push run结束的标记
+            self.wait_retries()
+        if len(self.failed_files) != 0:
+            logger.error(f'{len(self.failed_files)} push failed， they are: {self.failed_files}')
+        return True
+
+    def finish_chip(self):
         self.known_chips[self.current_chip] = 1
         self.queued_chips.remove(self.current_chip)
-        with open(self.history_file, 'w') as f:
-            json.dump(self.known_chips, f, indent=2)
+        dump_json(self.known_chips, self.history_file, indent=2)
+        self.checkpoint.finish(self.current_chip)
+        self.status.finish(self.current_chip)
+        self.throughput.save(force=True)
+        if self.hashes:
+            self.hashes.save(force=True)
 
     def consumer(self):
         logger.info('Start consumer...')
@@ -230,20 +433,129 @@ class PushTask(object):
             if chip is None:
                 break
             self.current_chip = chip
-            self.push()
+            if self.leases is None:
+                if self.push():
+                    self.finish_chip()
+                else:
+                    # 之后的全量扫描会重新排队
+                    self.queued_chips.discard(chip)
+                    self.checkpoint.save(force=True)
+            else:
+                self.push_shards()
+
+    def acquire_all(self, chip):
+        """
+        领取 chip 所有可领取的分片。先领一个，等 shard_spread 秒后再连续领取剩下的，
+        这段时间内也发现了这个 chip 的节点至少各领到一个分片；只有一个节点时它领到全部分片。
+        """
+        lease = self.leases.acquire(chip)
+        if lease is None:
+            return []
+        leases = [lease]
+        if lease.shard == FINAL or self.leases.shards == 1:
+            return leases
+        time.sleep(self.shard_spread)
+        while not self.exit_stat:
+            lease = self.leases.acquire(chip)  # 手上的分片没完成，不会领到 final
+            if lease is None:
+                break
+            leases.append(lease)
+        return leases
+
+    def push_shards(self):
+        """
+        多节点：领取当前 chip 所有可领取的分片，一次遍历推送这些分片的文件，直到没有可领取的分片。
+        节点数少于分片数时，多出的分片也随 run 实时推送，不会等到前一个分片所在的 run 结束。
+        """
+        chip = self.current_chip
+        while not self.exit_stat:
+            self.held_leases = self.acquire_all(chip)
+            if not self.held_leases:
+                break
+            if self.held_leases[0].shard == FINAL:
+                # 所有分片都已完成，只剩 run 结束标记
+                self.failed_files = []
+                self.push_path(self.seq.run_completion_status_xml)
+                self.wait_retries()
+                complete = True
+            else:
+                complete = self.push()
+            leases, self.held_leases = self.held_leases, ()
+            failed = {shard_of(Path(x).relative_to(self.src).as_posix(), self.leases.shards) for x in self.failed_files}
+            for lease in leases:
+                if lease.lost:
+                    logger.warning(f'{lease.name} taken over by another node, stop pushing it')
+                elif not complete or lease.shard in failed or (lease.shard == FINAL and self.failed_files):
+                    self.leases.release(lease)  # 没推完或有文件失败，放回去等下次扫描时重试（本节点或其他节点）
+                else:
+                    self.leases.release(lease, done=True)
+            if not complete or self.failed_files:
+                break
+        if self.leases.chip_done(chip):
+            self.finish_chip()
+        else:
+            # 其余分片在其他节点上推送；之后的全量扫描会再次尝试，持有者挂掉时在这里接管
+            self.queued_chips.discard(chip)
+            self.checkpoint.save(force=True)
 
-    def producer(self):
+    def producer(self, poll_interval=5, full_interval=300):
         logger.info('Start producer...')
+        watcher = DirWatcher(self.src)
+        last_full = time.time()
+        self.find_new_chip(force=True)
         while not self.exit_stat:
-            self.find_new_chip()
-            for x in range(300):
-                time.sleep(1)
+            # inotify 事件立即触发扫描；网络盘收不到事件，每 poll_interval 秒比较一次根目录 mtime
+            changed = False
+            for x in range(poll_interval):
+                if watcher.wait(1):
+                    changed = True
+                    break
                 if self.exit_stat:
                     break
+            if self.exit_stat:
+                break
+            full = time.time() - last_full >= full_interval  # 兜底：mtime 精度不够时也能发现新 chip
+            if full:
+                last_full = time.time()
+            self.find_new_chip(force=changed or full)
+        watcher.close()
+
+    def plan(self, chips=None):
+        """--dry-run：只打印传输计划，不上传，也不修改历史和断点"""
+        self.check_config()
+        self.checkpoint.load()
+        self.throughput.load()
+        if not chips:
+            self.load_history(save=False)
+            chips = [x for x in self.checkpoint.in_progress() if x not in self.known_chips]
+            with os.scandir(self.src) as entries:
+                chips += sorted(x.name for x in entries if len(x.name.split('_')) == 4 and x.is_dir()
+                                and x.name not in self.known_chips and x.name not in chips)
+        TransferPlanner(self).report(chips)
+
+    def setup_leases(self):
+        if self.lease_store is None:
+            return
+        if self.lease_store == 'bucket':
+            store = BucketLeaseStore(self.bucket)
+        else:
+            store = LocalLeaseStore(self.lease_store)
+        self.leases = LeaseManager(store, **self.lease_options)
+        self.leases.on_lost = self.on_lease_lost
+        self.leases.start()
+        logger.info(f'coordinate with other nodes as {self.leases.node}, {self.leases.shards} shards per chip')
 
     def loop(self):
         self.check_config()
+        self.checkpoint.load()
+        self.throughput.load()
+        if self.hashes:
+            self.hashes.load()
+        self.status.load()
         self.load_history()
+        self.resume()
+        self.retries.start()
+        self.setup_leases()
         signal.signal(signal.SIGINT, self.signal_handle)
         signal.signal(signal.SIGTERM, self.signal_handle)
         t1 = Thread(target=self.producer, daemon=True)
@@ -258,6 +570,10 @@ class PushTask(object):
         if self.exit_stat:
             raise SystemExit(f'Force exit by signal: {signum}')
         logger.warning(f'SIG {signum} received')
+        self.checkpoint.save(force=True)
+        self.status.save(force=True)
+        if self.hashes:
+            self.hashes.save(force=True)
         logger.warning('Stop producer')
         self.exit_stat = True
         logger.warning('Warm stop consumer')
@@ -279,8 +595,16 @@ def main():
         logging.basicConfig(level=level, format=formatstr)
 
     logger.info('program start')
-
-    task = PushTask(args.src, args.bucket, configfile=args.config, dry_run=args.dry_run, force=args.force)
+    if args.check_writers:
+        Sequence.readiness = ReadinessDetector(check_writers=True)
+
+    task = PushTask(args.src, args.bucket, configfile=args.config, dry_run=args.dry_run, force=args.force,
+                    max_retries=args.max_retries, pack=args.pack, lease_store=args.lease_store,
+                    lease_ttl=args.lease_ttl, shards=args.shards, node=args.node, sendfile=args.sendfile,
+                    dedup=args.dedup)
+    if args.dry_run:
+        task.plan(args.chips)
+        return
     task.loop()
 
 
@@ -295,8 +619,29 @@ def arg_handle():
     parser.add_argument('--config-file', metavar='file', dest='config',
                         help='Config file to use', default='config.ini')
     parser.add_argument('--dry-run', dest='dry_run', action='store_true',
-                        help='Only print cmd, not exec it', default=False)
+                        help='print the transfer plan and estimated time, not upload anything', default=False)
+    parser.add_argument('--chip', dest='chips', metavar='name', action='append',
+                        help='with --dry-run, plan these chips instead of the ones a real run would push')
     parser.add_argument('--force', action='store_true', help='force push, ignore existing files in server', default=False)
+    parser.add_argument('--max-retries', metavar='int', dest='max_retries', type=int, default=8,
+                        help='max attempts for a failed file in the background retry queue')
+    parser.add_argument('--pack', action='store_true', default=False,
+                        help='upload Images, Thumbnail_Images, RTALogs and Logs as a few tar objects')
+    parser.add_argument('--lease', dest='lease_store', metavar='bucket|dir',
+                        help='coordinate several push nodes with leases stored in the bucket or a shared dir')
+    parser.add_argument('--lease-ttl', dest='lease_ttl', metavar='seconds', type=int, default=600,
+                        help='a lease not renewed for this long is taken over by another node')
+    parser.add_argument('--shards', metavar='int', type=int, default=1,
+                        help='with --lease, split each chip into this many shards, must be the same on all nodes')
+    parser.add_argument('--node', metavar='name', help='node name for leases, default hostname:pid')
+    parser.add_argument('--sendfile', action='store_true', default=False,
+                        help='upload with zero-copy sendfile, best with http or TLS-offloaded endpoints; '
+                             'checks size but not CRC64')
+    parser.add_argument('--dedup', action='store_true', default=False,
+                        help='hash file contents: skip identical files even with --force, copy on server instead of '
+                             'uploading content that already exists, and catch changed files of the same size')
+    parser.add_argument('--check-writers', dest='check_writers', action='store_true', default=False,
+                        help='also wait until no local process has a file open for writing before pushing it')
     return parser.parse_args()
 
 
@@ -0,0 +1,125 @@
+"""
+    远端 bucket 变化跟踪：按前缀缓存列表，用 marker(start-after) 从要找的 key 之前开始列表，只拉取它附近的新 key
+"""
+
+import logging
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def parent_prefix(name):
+    name = name.strip('/')
+    if '/' not in name:
+        return ''
+    return name.rsplit('/', 1)[0] + '/'
+
+
+class RemoteIndex(object):
+    """
+    缓存每个前缀（一层目录）下的对象和子目录。
+
+    lister(prefix, marker) 返回 prefix 下排在 marker 之后的完整 key（子目录以 / 结尾）。
+    同一前缀下有多类 key（如 lane 目录里的 NNNN.bcl.bgzf 和排在最后、最先上传的 s_N.bci），
+    所以不能用列到过的最大 key 作 marker。查询某个 key 时用缓存中比它小的最大 key 作 marker，
+    返回的只有它和排在它后面的少量 key，且它如果存在一定在其中，不需要全量列表。
+    不带 marker 的刷新（如发现新 chip）用列到过的最大 key 增量列表，每 full_every 次全量一次，
+    以便发现乱序上传（如失败重传）的对象。
+    """
+
+    def __init__(self, lister, full_every=30):
+        self.lister = lister
+        self.full_every = full_every
+        self.entries = {}
+        self.markers = {}
+        self.refresh_count = {}
+        self.lock = Lock()
+
+    def refresh(self, prefix, full=False, marker=None):
+        """刷新 prefix 的缓存，返回新发现的 key；指定 marker 时只列 marker 之后的 key"""
+        with self.lock:
+            if marker is None:
+                count = self.refresh_count.get(prefix, 0) + 1
+                self.refresh_count[prefix] = count
+                if prefix not in self.entries or count % self.full_every == 0:
+                    full = True
+                marker = '' if full else self.markers.get(prefix, '')
+            names = self.lister(prefix, marker)
+            known = self.entries.get(prefix, set())
+            new = [x for x in names if x not in known]
+            if full:
+                self.entries[prefix] = set(names)
+            else:
+                known.update(names)
+                self.entries[prefix] = known
+            if names:
+                self.markers[prefix] = max(max(names), self.markers.get(prefix, ''))
+            logger.debug(f'list {prefix or "/"} after "{marker}": {len(names)} keys, {len(new)} new')
+            return new
+
+    def names(self, prefix):
+        with self.lock:
+            return set(self.entries.get(prefix, set()))
+
+    def _has(self, prefix, name):
+        entries = self.entries.get(prefix, set())
+        return name in entries or name + '/' in entries
+
+    def exists(self, name):
+        """name 是否已存在（对象或目录），缓存没有时从比它小的最大已知 key 之后列一次"""
+        name = name.strip('/')
+        prefix = parent_prefix(name)
+        with self.lock:
+            if self._has(prefix, name):
+                return True
+            marker = max((x for x in self.entries.get(prefix, ()) if x < name), default=prefix)
+        self.refresh(prefix, marker=marker)
+        with self.lock:
+            return self._has(prefix, name)
+
+    def is_dir(self, name):
+        name = name.strip('/')
+        with self.lock:
+            return name + '/' in self.entries.get(parent_prefix(name), set())
+
+
+class AdaptivePoller(object):
+    """
+    自适应轮询间隔。
+
+    记录新对象到达的平均间隔（约等于一个 cycle 的耗时）：离预计到达还早时直接睡到预计时间，
+    到达窗口内按 min_interval 密集轮询，超过窗口仍无变化则视为空闲，按 factor 指数退避到 max_interval。
+    """
+
+    def __init__(self, min_interval=5, max_interval=300, factor=2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.interval = min_interval
+        self.gap = None
+        self.last_change = time.time()
+
+    def changed(self):
+        now = time.time()
+        gap = now - self.last_change
+        self.gap = gap if self.gap is None else 0.7 * self.gap + 0.3 * gap
+        self.last_change = now
+        self.interval = self.min_interval
+
+    def next_delay(self):
+        if self.gap is not None:
+            elapsed = time.time() - self.last_change
+            if elapsed < self.gap * 0.8:
+                return min(max(self.gap * 0.8 - elapsed, self.min_interval), self.max_interval)
+            if elapsed < self.gap * 3:
+                return self.min_interval
+        delay = self.interval
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return delay
+
+    def wait(self):
+        delay = self.next_delay()
+        logger.debug(f'poll again after {delay:.0f}s')
+        time.sleep(delay)
+        return delay
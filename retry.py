@@ -0,0 +1,205 @@
+"""
+    失败重传队列：后台线程按指数退避+抖动重试，按错误类型决定是否重试，带熔断和重试预算
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import time
+from threading import Condition, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+THROTTLE = 'throttle'
+TRANSIENT = 'transient'
+AUTH = 'auth'
+NOT_FOUND = 'not_found'
+
+AUTH_CODES = ('AccessDenied', 'InvalidAccessKeyId', 'SignatureDoesNotMatch', 'RequestTimeTooSkewed')
+THROTTLE_CODES = ('SlowDown', 'ServerBusy', 'QpsLimitExceeded', 'Throttling')
+
+
+def classify(error):
+    """oss2 的异常带 status 和 code，网络错误（RequestError）status 为 -2，按 transient 处理"""
+    if isinstance(error, FileNotFoundError):
+        return NOT_FOUND
+    status = getattr(error, 'status', None)
+    code = getattr(error, 'code', None) or ''
+    if code in AUTH_CODES or status == 403:
+        return AUTH
+    if code in THROTTLE_CODES or status in (429, 503):
+        return THROTTLE
+    if code.startswith('NoSuch') or status == 404:
+        return NOT_FOUND
+    return TRANSIENT
+
+
+def is_fatal(error):
+    """重试也不会成功的错误：认证、对象不存在，以及除 412（对象被覆盖）、429（限流）外的 4xx"""
+    kind = classify(error)
+    if kind in (AUTH, NOT_FOUND):
+        return True
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (412, 429)
+
+
+def backoff(attempt, kind, base_delay=2, max_delay=300):
+    """指数退避加抖动，限流错误的基数是普通错误的 4 倍"""
+    base = base_delay * (4 if kind == THROTTLE else 1)
+    delay = min(max_delay, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker(object):
+    """连续失败 threshold 次后熔断 cooldown 秒，之后放行一次探测，成功则恢复"""
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None and time.time() - self.opened_at < self.cooldown
+
+    def retry_at(self):
+        return (self.opened_at or 0) + self.cooldown
+
+    def success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info('endpoint recovered, close circuit breaker')
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if not self.is_open:
+                    logger.warning(f'{self.failures} failures in a row, pause for {self.cooldown}s')
+                self.opened_at = time.time()
+
+
+class RetryBudget(object):
+    """令牌桶：最多攒 capacity 次重试，每秒补充 rate 次，防止故障时重试风暴"""
+
+    def __init__(self, capacity=30, rate=0.5):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.time()
+
+    def take(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+class RetryQueue(object):
+    """
+    func(item) 失败时抛异常。
+
+    认证错误和 not found 不重试，直接记入 failed；限流错误的退避基数是普通错误的 4 倍。
+    主流程只管 submit，不会被重试阻塞；需要等全部重试结束时调用 drain。
+    """
+
+    def __init__(self, func, max_attempts=8, base_delay=2, max_delay=300, breaker=None, budget=None):
+        self.func = func
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.heap = []
+        self.counter = itertools.count()
+        self.pending = 0
+        self.failed = []
+        self.cond = Condition()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def backoff(self, attempt, kind):
+        return backoff(attempt, kind, self.base_delay, self.max_delay)
+
+    def submit(self, item, error=None):
+        kind = classify(error) if error is not None else TRANSIENT
+        if kind in (AUTH, NOT_FOUND):
+            logger.error(f'{item} failed with {kind} error, not retry, msg: {error}')
+            with self.cond:
+                self.failed.append(item)
+            return
+        with self.cond:
+            self.pending += 1
+            self.schedule(item, 0, kind)
+
+    def schedule(self, item, attempt, kind, due=None):
+        if due is None:
+            due = time.time() + self.backoff(attempt, kind)
+        heapq.heappush(self.heap, (due, next(self.counter), item, attempt))
+        self.cond.notify_all()
+
+    def done(self, item=None):
+        self.pending -= 1
+        if item is not None:
+            self.failed.append(item)
+        self.cond.notify_all()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.time():
+                    self.cond.wait(self.heap[0][0] - time.time() if self.heap else None)
+                due, _, item, attempt = heapq.heappop(self.heap)
+                if self.breaker.is_open:
+                    heapq.heappush(self.heap, (self.breaker.retry_at(), next(self.counter), item, attempt))
+                    continue
+                if not self.budget.take():
+                    heapq.heappush(self.heap, (time.time() + self.budget.wait_time(), next(self.counter), item, attempt))
+                    continue
+            try:
+                self.func(item)
+            except Exception as e:
+                self.breaker.failure()
+                kind = classify(e)
+                attempt += 1
+                with self.cond:
+                    if kind in (AUTH, NOT_FOUND) or attempt >= self.max_attempts:
+                        logger.error(f'retry {item} failed ({attempt} attempts, {kind}), give up, msg: {e}')
+                        self.done(item)
+                    else:
+                        logger.warning(f'retry {item} failed ({attempt}/{self.max_attempts}, {kind}), msg: {e}')
+                        self.schedule(item, attempt, kind)
+                continue
+            self.breaker.success()
+            logger.info(f'retry {item} succeeded')
+            with self.cond:
+                self.done()
+
+    def drain(self, timeout=None):
+        """等待所有已提交的重试结束（成功或放弃），返回是否在 timeout 内结束"""
+        end = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.pending:
+                if end is not None and time.time() >= end:
+                    return False
+                self.cond.wait(None if end is None else end - time.time())
+        return True
+
+    def pop_failed(self):
+        with self.cond:
+            failed, self.failed = self.failed, []
+        return failed
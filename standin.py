@@ -0,0 +1,352 @@
+"""
+    本地 OSS 替身服务：只实现 push/pull/bench 用到的接口（对象读写、range、分片上传、列表、复制、删除），
+    数据存放在本地目录，不校验签名。用于 bench 和本地调试，不要暴露到外网
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from oss2.utils import Crc64
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectStore(object):
+    """key 编码成单个文件名保存，元数据只放在内存里"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        (self.root / 'objects').mkdir(parents=True, exist_ok=True)
+        (self.root / 'uploads').mkdir(parents=True, exist_ok=True)
+        self.meta = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return self.root / 'objects' / quote(key, safe='')
+
+    @staticmethod
+    def write(path, chunks):
+        md5 = hashlib.md5()
+        crc = Crc64()
+        size = 0
+        tmp = path.with_name(path.name + '.tmp' + uuid.uuid4().hex)
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                md5.update(chunk)
+                crc.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        return tmp, {'size': size, 'etag': md5.hexdigest().upper(), 'crc': crc.crc, 'mtime': time.time(), 'user': {}}
+
+    def put(self, key, chunks, user_meta=None, forbid_overwrite=False):
+        if forbid_overwrite and key in self.meta:
+            return None
+        tmp, meta = self.write(self.path(key), chunks)
+        meta['user'] = user_meta or {}
+        return self.commit(key, tmp, meta, forbid_overwrite)
+
+    def commit(self, key, tmp, meta, forbid_overwrite=False):
+        """内容和元数据在同一把锁里生效，并发写同一个 key 时不会读到另一个请求的内容"""
+        with self.lock:
+            if forbid_overwrite and key in self.meta:
+                os.unlink(tmp)
+                return None
+            os.replace(tmp, self.path(key))
+            self.meta[key] = meta
+        return meta
+
+    def copy(self, src, key):
+        if src not in self.meta:
+            return None
+        shutil.copyfile(self.path(src), self.path(key))
+        with self.lock:
+            self.meta[key] = dict(self.meta[src], mtime=time.time())
+        return self.meta[key]
+
+    def delete(self, key):
+        with self.lock:
+            self.meta.pop(key, None)
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def init_upload(self, key, user_meta):
+        upload_id = uuid.uuid4().hex
+        (self.root / 'uploads' / upload_id).mkdir()
+        self.uploads[upload_id] = {'key': key, 'parts': {}, 'user': user_meta}
+        return upload_id
+
+    def put_part(self, upload_id, number, chunks):
+        path = self.root / 'uploads' / upload_id / str(number)
+        tmp, meta = self.write(path, chunks)
+        os.replace(tmp, path)
+        self.uploads[upload_id]['parts'][number] = meta
+        return meta
+
+    def complete(self, upload_id, numbers):
+        upload = self.uploads.pop(upload_id)
+        part_dir = self.root / 'uploads' / upload_id
+
+        def chunks():
+            for number in numbers:
+                with open(part_dir / str(number), 'rb') as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+        tmp, meta = self.write(self.path(upload['key']), chunks())
+        meta['etag'] = meta['etag'] + f'-{len(numbers)}'
+        meta['user'] = upload['user']
+        self.commit(upload['key'], tmp, meta)
+        shutil.rmtree(part_dir, ignore_errors=True)
+        return upload['key'], meta
+
+    def list(self, prefix='', marker='', delimiter='', max_keys=100):
+        with self.lock:
+            keys = sorted(x for x in self.meta if x.startswith(prefix) and x > marker)
+        contents = []
+        prefixes = []
+        next_marker = ''
+        for key in keys:
+            if len(contents) + len(prefixes) >= max_keys:
+                return contents, prefixes, next_marker
+            if delimiter and delimiter in key[len(prefix):]:
+                common = prefix + key[len(prefix):].split(delimiter, 1)[0] + delimiter
+                if common not in prefixes and common > marker:
+                    prefixes.append(common)
+                    next_marker = common
+                continue
+            contents.append(key)
+            next_marker = key
+        return contents, prefixes, ''
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    store = None
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def parse(self):
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        self.bucket = unquote(bucket)
+        self.key = unquote(key)
+        self.params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        self.user_meta = {k.lower(): v for k, v in self.headers.items() if k.lower().startswith('x-oss-meta-')}
+        self.body_read = False
+
+    def body(self):
+        """按 Content-Length 或 chunked 分块读取请求体"""
+        self.body_read = True
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                data = self.rfile.read(size)
+                self.rfile.readline()
+                yield data
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+    def reply(self, status, body=b'', headers=None, send_body=True):
+        if not self.body_read:
+            for _ in self.body():
+                pass  # 没读完的请求体会污染 keep-alive 连接上的下一个请求
+        self.send_response(status)
+        self.send_header('x-oss-request-id', uuid.uuid4().hex)
+        self.send_header('Date', formatdate(usegmt=True))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def error(self, status, code):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'
+        self.reply(status, body.encode(), {'Content-Type': 'application/xml'}, send_body=self.command != 'HEAD')
+
+    def object_headers(self, meta):
+        headers = {
+            'ETag': f'"{meta["etag"]}"',
+            'x-oss-hash-crc64ecma': meta['crc'],
+            'Last-Modified': formatdate(meta['mtime'], usegmt=True),
+            'x-oss-object-type': 'Normal',
+        }
+        headers.update(meta['user'])
+        return headers
+
+    def do_PUT(self):
+        self.parse()
+        if 'partNumber' in self.params:
+            if self.params.get('uploadId') not in self.store.uploads:
+                return self.error(404, 'NoSuchUpload')
+            meta = self.store.put_part(self.params['uploadId'], int(self.params['partNumber']), self.body())
+            return self.reply(200, headers={'ETag': f'"{meta["etag"]}"', 'x-oss-hash-crc64ecma': meta['crc']})
+        source = self.headers.get('x-oss-copy-source')
+        if source:
+            _, _, src_key = unquote(source).lstrip('/').partition('/')
+            meta = self.store.copy(src_key, self.key)
+            if meta is None:
+                return self.error(404, 'NoSuchKey')
+            body = f'<CopyObjectResult><ETag>"{meta["etag"]}"</ETag><LastModified>{iso8601(meta["mtime"])}</LastModified></CopyObjectResult>'
+            return self.reply(200, body.encode(), dict(self.object_headers(meta), **{'Content-Type': 'application/xml'}))
+        forbid = self.headers.get('x-oss-forbid-overwrite', '').lower() == 'true'
+        meta = self.store.put(self.key, self.body(), self.user_meta, forbid_overwrite=forbid)
+        if meta is None:
+            return self.error(409, 'FileAlreadyExists')
+        self.reply(200, headers={'ETag': f'"{meta["etag"]}"', 'x-oss-hash-crc64ecma': meta['crc']})
+
+    def do_POST(self):
+        self.parse()
+        if 'uploads' in self.params:
+            upload_id = self.store.init_upload(self.key, self.user_meta)
+            body = (f'<InitiateMultipartUploadResult><Bucket>{escape(self.bucket)}</Bucket><Key>{escape(self.key)}</Key>'
+                    f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+            return self.reply(200, body.encode(), {'Content-Type': 'application/xml'})
+        if 'uploadId' in self.params:
+            if self.params['uploadId'] not in self.store.uploads:
+                return self.error(404, 'NoSuchUpload')
+            root = ElementTree.fromstring(b''.join(self.body()))
+            numbers = [int(x.findtext('PartNumber')) for x in root.findall('Part')]
+            key, meta = self.store.complete(self.params['uploadId'], numbers)
+            body = (f'<CompleteMultipartUploadResult><Bucket>{escape(self.bucket)}</Bucket><Key>{escape(key)}</Key>'
+                    f'<ETag>"{meta["etag"]}"</ETag></CompleteMultipartUploadResult>')
+            return self.reply(200, body.encode(), {'Content-Type': 'application/xml', 'ETag': f'"{meta["etag"]}"',
+                                                   'x-oss-hash-crc64ecma': meta['crc']})
+        self.error(400, 'InvalidArgument')
+
+    def do_DELETE(self):
+        self.parse()
+        self.store.delete(self.key)
+        self.reply(204)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self.parse()
+        if not self.key:
+            return self.list_objects()
+        if 'uploadId' in self.params:
+            return self.list_parts()
+        meta = self.store.meta.get(self.key)
+        if meta is None:
+            return self.error(404, 'NoSuchKey')
+        if_match = self.headers.get('If-Match')
+        if if_match and if_match.strip('"') != meta['etag']:
+            return self.error(412, 'PreconditionFailed')
+        start, end, status = 0, meta['size'] - 1, 200
+        headers = self.object_headers(meta)
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and meta['size']:
+            first, _, last = byte_range[6:].partition('-')
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            else:
+                start = max(0, meta['size'] - int(last))
+            if start > end:
+                return self.error(416, 'InvalidRange')
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{meta["size"]}'
+        headers['Content-Length'] = end - start + 1
+        headers['Content-Type'] = 'application/octet-stream'
+        self.reply(status, headers=headers, send_body=False)
+        if self.command == 'HEAD':
+            return
+        with open(self.store.path(self.key), 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def list_parts(self):
+        upload = self.store.uploads.get(self.params['uploadId'])
+        if upload is None:
+            return self.error(404, 'NoSuchUpload')
+        items = [f'<Part><PartNumber>{number}</PartNumber><LastModified>{iso8601(meta["mtime"])}</LastModified>'
+                 f'<ETag>"{meta["etag"]}"</ETag><Size>{meta["size"]}</Size></Part>'
+                 for number, meta in sorted(upload['parts'].items())]
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><ListPartsResult><Bucket>{escape(self.bucket)}</Bucket>'
+                f'<Key>{escape(self.key)}</Key><UploadId>{self.params["uploadId"]}</UploadId>'
+                f'<IsTruncated>false</IsTruncated><NextPartNumberMarker></NextPartNumberMarker>'
+                + ''.join(items) + '</ListPartsResult>')
+        self.reply(200, body.encode(), {'Content-Type': 'application/xml'})
+
+    def list_objects(self):
+        contents, prefixes, next_marker = self.store.list(
+            self.params.get('prefix', ''), self.params.get('marker', ''), self.params.get('delimiter', ''),
+            int(self.params.get('max-keys', 100)))
+        items = []
+        for key in contents:
+            meta = self.store.meta[key]
+            items.append(f'<Contents><Key>{escape(key)}</Key><LastModified>{iso8601(meta["mtime"])}</LastModified>'
+                         f'<ETag>"{meta["etag"]}"</ETag><Type>Normal</Type><Size>{meta["size"]}</Size>'
+                         f'<StorageClass>Standard</StorageClass></Contents>')
+        for prefix in prefixes:
+            items.append(f'<CommonPrefixes><Prefix>{escape(prefix)}</Prefix></CommonPrefixes>')
+        truncated = 'true' if next_marker else 'false'
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult><Name>{escape(self.bucket)}</Name>'
+                f'<Prefix>{escape(self.params.get("prefix", ""))}</Prefix><Marker>{escape(self.params.get("marker", ""))}</Marker>'
+                f'<IsTruncated>{truncated}</IsTruncated><NextMarker>{escape(next_marker)}</NextMarker>'
+                + ''.join(items) + '</ListBucketResult>')
+        self.reply(200, body.encode(), {'Content-Type': 'application/xml'})
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        logger.debug(f'connection from {client_address} closed with error', exc_info=True)
+
+
+def iso8601(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+def serve(root, host='127.0.0.1', port=0, ready=None):
+    """在当前进程里运行，ready 为 multiprocessing 的 Queue 时把实际端口放进去"""
+    handler = type('StandInHandler', (Handler,), {'store': ObjectStore(root)})
+    server = Server((host, port), handler)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    logger.info(f'stand-in server listening on http://{host}:{server.server_address[1]}, data in {root}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='local OSS stand-in server, for bench and debugging only')
+    parser.add_argument('root', metavar='data_dir', type=Path, help='dir to keep objects in')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(levelname)s %(message)s')
+    serve(args.root, port=args.port)
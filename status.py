@@ -0,0 +1,259 @@
+#! encoding=utf-8
+"""
+    run 同步状态索引：push / pull 在处理文件时增量记录每个 chip、lane、cycle 的状态，
+    查询时只读索引文件，不访问本地目录和 bucket
+
+    python status.py                          # 所有 chip 的概况
+    python status.py CHIP                     # 每个 lane 各状态的 cycle
+    python status.py CHIP --missing verified  # 还没有校验上传完成的 cycle
+"""
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from threading import Lock
+
+from checkpoint import dump_json
+
+script_dir = Path(__file__).resolve().parent
+
+# push 端的状态逐级递进，记录高一级时低一级一起记录；pulled 由 pull 端单独记录
+PUSH_STATES = ('on_disk', 'uploaded', 'verified')
+STATES = PUSH_STATES + ('pulled',)
+
+PUSH_INDEX = '.mdx.push.status.json'
+PULL_INDEX = '.mdx.pull.status.json'
+
+# 对象 key（chip/相对路径）-> 类别，与 Sequence 的目录结构一致；lane 级文件的 cycle 记为 0
+PATTERNS = (
+    ('bcl', re.compile(r'^Data/Intensities/BaseCalls/L00(\d)/(\d{4})\.bcl\.bgzf$')),
+    ('bci', re.compile(r'^Data/Intensities/BaseCalls/L00(\d)/(\d{4})\.bcl\.bgzf\.bci$')),
+    ('lane_bci', re.compile(r'^Data/Intensities/BaseCalls/L00(\d)/s_\d\.bci$')),
+    ('filter', re.compile(r'^Data/Intensities/BaseCalls/L00(\d)/s_\d\.filter$')),
+    ('locs', re.compile(r'^Data/Intensities/L00(\d)/s_\d\.locs$')),
+)
+
+
+def parse(name):
+    """返回 (chip, 类别, lane, cycle)；run 根目录下的文件类别为 run，lane 为文件名；其余文件返回 None"""
+    chip, _, rel = name.partition('/')
+    for kind, pattern in PATTERNS:
+        m = pattern.match(rel)
+        if m:
+            return chip, kind, m.group(1), int(m.group(2)) if kind in ('bcl', 'bci') else 0
+    if rel and '/' not in rel:
+        return chip, 'run', rel, 0
+    return None
+
+
+def to_ranges(values):
+    """{1, 2, 3, 5} -> '1-3,5'，索引里的 cycle 列表都这样压缩保存"""
+    values = sorted(values)
+    parts = []
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1] == values[j] + 1:
+            j += 1
+        parts.append(str(values[i]) if i == j else f'{values[i]}-{values[j]}')
+        i = j + 1
+    return ','.join(parts)
+
+
+def from_ranges(text):
+    values = set()
+    for part in filter(None, text.split(',')):
+        start, _, end = part.partition('-')
+        values.update(range(int(start), int(end or start) + 1))
+    return values
+
+
+class StatusIndex(object):
+    """
+    chip -> {
+        'lanes': lane 数, 'cycles': cycle 数（RunInfo.xml 之前为 None）, 'done': 是否处理完, 'updated': 时间戳,
+        'files': {类别: {状态: {lane: cycle 集合}}}
+    }
+    文件中 cycle 集合保存为 '1-25,27' 这样的区间；保存最多每 interval 秒一次，先写临时文件再改名。
+    """
+
+    def __init__(self, path, interval=5):
+        self.path = Path(path)
+        self.interval = interval
+        self.chips = {}
+        self.last_save = 0
+        self.dirty = False
+        self.lock = Lock()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        for chip, entry in data.items():
+            for states in entry['files'].values():
+                for state, lanes in states.items():
+                    states[state] = {lane: from_ranges(text) for lane, text in lanes.items()}
+            self.chips[chip] = entry
+
+    def entry(self, chip):
+        return self.chips.setdefault(chip, {'lanes': 4, 'cycles': None, 'done': False, 'updated': 0, 'files': {}})
+
+    def set_layout(self, chip, cycles, lanes=4):
+        with self.lock:
+            entry = self.entry(chip)
+            if entry['cycles'] == cycles and entry['lanes'] == lanes:
+                return
+            entry.update(cycles=cycles, lanes=lanes, updated=time.time())
+            self.dirty = True
+        self.save()
+
+    def record(self, name, state):
+        """name 为对象 key；push 的状态会连同更低的状态一起记录"""
+        parsed = parse(name)
+        if parsed is None:
+            return  # Images、Logs 等目录下的文件不单独跟踪
+        chip, kind, lane, cycle = parsed
+        states = PUSH_STATES[:PUSH_STATES.index(state) + 1] if state in PUSH_STATES else (state,)
+        with self.lock:
+            entry = self.entry(chip)
+            files = entry['files'].setdefault(kind, {})
+            for x in states:
+                files.setdefault(x, {}).setdefault(lane, set()).add(cycle)
+            entry['updated'] = time.time()
+            self.dirty = True
+        self.save()
+
+    def finish(self, chip):
+        with self.lock:
+            entry = self.entry(chip)
+            entry.update(done=True, updated=time.time())
+            self.dirty = True
+        self.save(force=True)
+
+    def save(self, force=False):
+        with self.lock:
+            if not self.dirty and not force:
+                return
+            if not force and time.time() - self.last_save < self.interval:
+                return
+            data = {}
+            for chip, entry in self.chips.items():
+                files = {kind: {state: {lane: to_ranges(cycles) for lane, cycles in lanes.items()}
+                                for state, lanes in states.items()}
+                         for kind, states in entry['files'].items()}
+                data[chip] = dict(entry, files=files)
+            dump_json(data, self.path)
+            self.last_save = time.time()
+            self.dirty = False
+
+
+def merge(indexes):
+    """push 和 pull 的索引合并成一份，状态取并集"""
+    chips = {}
+    for index in indexes:
+        for chip, entry in index.chips.items():
+            merged = chips.setdefault(chip, {'lanes': entry['lanes'], 'cycles': None, 'done': {}, 'updated': 0,
+                                             'files': {}})
+            merged['cycles'] = merged['cycles'] or entry['cycles']
+            merged['done'][index.path.name] = entry['done']
+            merged['updated'] = max(merged['updated'], entry['updated'])
+            for kind, states in entry['files'].items():
+                for state, lanes in states.items():
+                    for lane, cycles in lanes.items():
+                        merged['files'].setdefault(kind, {}).setdefault(state, {}).setdefault(lane, set()).update(cycles)
+    return chips
+
+
+def cycles_in(entry, state, lane):
+    """某个 lane 的 bcl 和 bci 都达到 state 的 cycle"""
+    files = entry['files']
+    bcl = files.get('bcl', {}).get(state, {}).get(str(lane), set())
+    bci = files.get('bci', {}).get(state, {}).get(str(lane), set())
+    return bcl & bci
+
+
+def missing(entry, state):
+    """{lane: 还没达到 state 的 cycle 集合}；cycle 数未知时按已出现过的最大 cycle 计算"""
+    total = entry['cycles']
+    if total is None:
+        seen = [c for lanes in entry['files'].get('bcl', {}).values() for cycles in lanes.values() for c in cycles]
+        total = max(seen, default=0)
+    result = {}
+    for lane in range(1, entry['lanes'] + 1):
+        result[lane] = set(range(1, total + 1)) - cycles_in(entry, state, lane)
+    return result
+
+
+def complete_cycles(entry, state):
+    """所有 lane 都达到 state 的 cycle 数"""
+    lanes = [cycles_in(entry, state, lane) for lane in range(1, entry['lanes'] + 1)]
+    return len(set.intersection(*lanes)) if lanes else 0
+
+
+def lane_files(entry, state):
+    kinds = []
+    for kind in ('lane_bci', 'locs', 'filter'):
+        lanes = entry['files'].get(kind, {}).get(state, {})
+        if len(lanes) == entry['lanes']:
+            kinds.append(kind)
+    return kinds
+
+
+def print_summary(chips):
+    print(f'{"chip":<36}{"cycles":>7}' + ''.join(f'{x:>10}' for x in STATES) + f'{"updated":>21}')
+    for chip in sorted(chips):
+        entry = chips[chip]
+        total = entry['cycles'] or '?'
+        counts = ''.join(f'{complete_cycles(entry, x):>10}' for x in STATES)
+        updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['updated']))
+        print(f'{chip:<36}{total:>7}{counts}{updated:>21}')
+
+
+def print_chip(chip, entry, state=None):
+    done = ', '.join(f'{k}: {"done" if v else "in progress"}' for k, v in entry['done'].items())
+    print(f'{chip}: {entry["cycles"] or "?"} cycles, {entry["lanes"]} lanes ({done})')
+    if state:
+        for lane, cycles in missing(entry, state).items():
+            print(f'L00{lane} missing {state}: {to_ranges(cycles) or "-"}')
+        print(f'lane files not {state}: {", ".join(x for x in ("lane_bci", "locs", "filter") if x not in lane_files(entry, state)) or "-"}')
+        return
+    for x in STATES:
+        print(f'{x}:')
+        for lane in range(1, entry['lanes'] + 1):
+            print(f'  L00{lane} cycles {to_ranges(cycles_in(entry, x, lane)) or "-"}')
+        print(f'  lane files: {", ".join(lane_files(entry, x)) or "-"}')
+        runs = sorted(entry['files'].get('run', {}).get(x, {}))
+        print(f'  run files: {", ".join(runs) or "-"}')
+
+
+def main():
+    args = arg_handle()
+    paths = args.indexes or [Path(PUSH_INDEX), script_dir / PULL_INDEX]
+    indexes = []
+    for path in paths:
+        index = StatusIndex(path)
+        index.load()
+        indexes.append(index)
+    chips = merge(indexes)
+    if not args.chip:
+        print_summary(chips)
+        return
+    if args.chip not in chips:
+        raise SystemExit(f'{args.chip} not found in {", ".join(str(x) for x in paths)}')
+    print_chip(args.chip, chips[args.chip], args.missing)
+
+
+def arg_handle():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('chip', nargs='?', help='show one chip, default all chips')
+    parser.add_argument('--missing', choices=STATES, help='with chip, list cycles not yet in this state')
+    parser.add_argument('--index', dest='indexes', metavar='file', type=Path, action='append',
+                        help=f'status index to read, default {PUSH_INDEX} in current dir and {PULL_INDEX} in script dir')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+    目录变化监听：Linux 下通过 ctypes 调用 inotify，其他平台或初始化失败时退回定时轮询
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class DirWatcher(object):
+    """
+    监听一个目录下的子目录增删。
+
+    注意 inotify 只能收到本机的修改，NFS/SMB 上由其他主机创建的目录收不到事件，调用方仍需配合 mtime 轮询。
+    """
+
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        if sys.platform != 'linux':
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            if libc.inotify_add_watch(fd, os.fsencode(str(path)), self.mask) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, f'inotify_add_watch {path} failed')
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            logger.warning(f'inotify unavailable, fall back to polling, msg: {e}')
+
+    def wait(self, timeout):
+        """等待目录变化，有事件返回 True，超时返回 False"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,114 @@
+"""
+    零拷贝上传：请求由 oss2 签名，请求体用 socket.sendfile 直接从文件发送到连接，不经过 Python 的 bytes。
+    http 端点（或者 TLS 在前置代理上卸载）时内核直接从 page cache 发送；https 时 socket.sendfile 自动退回分块读写。
+"""
+
+import http.client
+import logging
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from lazy import oss2
+
+logger = logging.getLogger(__name__)
+
+
+class SendfileUploader(object):
+    """
+    小于 oss2.defaults.multipart_threshold 的文件一次 PUT，其余分片在 uploader 自己的线程池里并发上传，
+    线程池跨文件复用，每个线程的长连接也随之复用。
+    check_crc 默认跟 bucket.enable_crc 一致（oss2 默认开启），每个请求都和服务端返回的 CRC64 比对；
+    关掉可以省下每 GB 数秒的 CPU，完整性只靠调用方的大小校验。
+    """
+
+    def __init__(self, bucket, part_size=None, num_threads=3, check_crc=None, retries=3, expires=900):
+        self.bucket = bucket
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.check_crc = bucket.enable_crc if check_crc is None else check_crc
+        self.retries = retries
+        self.expires = expires
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def connection(self, scheme, netloc, fresh=False):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and (fresh or self.local.target != (scheme, netloc)):
+            conn.close()
+            conn = None
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = cls(netloc, timeout=self.bucket.timeout)
+            self.local.conn = conn
+            self.local.target = (scheme, netloc)
+        return conn
+
+    def put(self, name, path, offset, size, params=None, headers=None):
+        """把文件 [offset, offset + size) 作为请求体 PUT，返回响应头"""
+        headers = oss2.http.CaseInsensitiveDict(headers)
+        headers['Content-Length'] = str(size)
+        if not params:
+            oss2.utils.set_content_type(headers, name)  # 和 put_object 一样按扩展名设置 Content-Type
+        for attempt in range(1, self.retries + 1):
+            # 用公开的 sign_url 签名（签名放在 query 里），每次重发都重新签，不会因为 expires 过期失败
+            url = urlsplit(self.bucket.sign_url('PUT', name, self.expires, headers=dict(headers), params=params,
+                                                slash_safe=True))
+            conn = self.connection(url.scheme, url.netloc, fresh=attempt > 1)
+            try:
+                conn.putrequest('PUT', f'{url.path}?{url.query}', skip_accept_encoding=True)
+                for key, value in headers.items():
+                    if value is not None:
+                        conn.putheader(key, value)
+                conn.endheaders()
+                if size:
+                    with open(path, 'rb') as f:
+                        conn.sock.sendfile(f, offset, size)
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                # 长连接被服务端关闭是常见情况，换新连接重发
+                conn.close()
+                if attempt == self.retries:
+                    raise
+                logger.warning(f'sendfile {name} ({offset}+{size}) error ({attempt}/{self.retries}), msg: {e}')
+                continue
+            if resp.status // 100 != 2:
+                e = oss2.exceptions.make_exception(resp)
+                resp.read()
+                raise e
+            resp.read()
+            return resp.headers
+
+    def verify(self, name, path, offset, size, headers):
+        server_crc = headers.get('x-oss-hash-crc64ecma')
+        if not self.check_crc or server_crc is None or size == 0:
+            return
+        crc = oss2.utils.Crc64()
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            crc.update(memoryview(buf)[offset:offset + size])  # 直接读映射，不拷贝成 bytes
+        if crc.crc != int(server_crc):
+            raise ValueError(f'crc64 error for {name} ({offset}+{size}), remote({server_crc}) != local({crc.crc})')
+
+    def upload_part(self, name, path, upload_id, number, offset, size):
+        headers = self.put(name, path, offset, size, params={'uploadId': upload_id, 'partNumber': str(number)})
+        self.verify(name, path, offset, size, headers)
+        return oss2.models.PartInfo(number, headers['ETag'].strip('"'), size=size)
+
+    def upload(self, path, name, headers=None):
+        path = Path(path)
+        total_size = path.stat().st_size
+        if total_size < oss2.defaults.multipart_threshold:
+            self.verify(name, path, 0, total_size, self.put(name, path, 0, total_size, headers=headers))
+            return
+        part_size = oss2.determine_part_size(total_size, preferred_size=self.part_size or oss2.defaults.part_size)
+        upload_id = self.bucket.init_multipart_upload(name, headers=headers).upload_id
+        jobs = [(number, offset, min(part_size, total_size - offset))
+                for number, offset in enumerate(range(0, total_size, part_size), 1)]
+        try:
+            parts = list(self.pool.map(lambda x: self.upload_part(name, path, upload_id, *x), jobs))
+            self.bucket.complete_multipart_upload(name, upload_id, parts)
+        except Exception:
+            self.bucket.abort_multipart_upload(name, upload_id)
+            raise